@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: import_times
+
+:Synopsis: Reports what it costs a worker to import the app, i.e., what uWSGI does on spawning or restarting a worker:
+    the wall time and peak RSS of a fresh interpreter that imports it, and the import time taken by each package and
+    by each of the app's own modules, as reported by python -X importtime. E.g.,
+        python import_times.py
+        python import_times.py webapp.creators.propagate_names
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+from collections import defaultdict
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 5
+TOP_N = 15
+
+
+def import_module(module_name, importtime=False):
+    # Returns (wall time in seconds, stderr) for importing the module in a fresh interpreter
+    args = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-c', f'import {module_name}']
+    start = time.perf_counter()
+    result = subprocess.run(args, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stderr
+
+
+def parse_importtime(stderr):
+    # Returns [(module, self microseconds, cumulative microseconds), ...]
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        modules.append((module.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def report(module_name):
+    wall_times = [import_module(module_name)[0] for _ in range(RUNS)]
+    # The children have all exited, so this is the peak RSS of the largest of them
+    max_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    modules = parse_importtime(import_module(module_name, importtime=True)[1])
+
+    print(f'import {module_name}: median {statistics.median(wall_times):.3f}s over {RUNS} runs, '
+          f'peak RSS {max_rss_kb / 1024:.1f} MiB, {len(modules)} modules imported')
+
+    by_package = defaultdict(int)
+    for module, self_us, _ in modules:
+        by_package[module.split('.')[0]] += self_us
+    print(f'\nTop {TOP_N} packages by import time:')
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:TOP_N]:
+        print(f'  {self_us / 1000:9.1f} ms  {package}')
+
+    print(f'\nThe app\'s modules, by cumulative import time:')
+    own_modules = [(module, cumulative_us) for module, _, cumulative_us in modules if module.startswith('webapp')]
+    for module, cumulative_us in sorted(own_modules, key=lambda item: -item[1]):
+        print(f'  {cumulative_us / 1000:9.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    report(sys.argv[1] if len(sys.argv) > 1 else 'wsgi')
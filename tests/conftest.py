@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: conftest
+
+:Synopsis: Fixtures shared by the tests. umbra_paths points Config at a base folder of its own, holding copies of the
+    EML files in tests/data/eml and the corrections files in data/, and at the SQLite storage backend, so the tests
+    need no database server and leave the configured data alone.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+from pathlib import Path
+import shutil
+
+import pytest
+
+from webapp.config import Config
+
+TESTS_PATH = Path(__file__).parent
+EML_FIXTURES_PATH = TESTS_PATH / 'data' / 'eml'
+CORRECTIONS_PATH = TESTS_PATH.parent / 'data'
+
+
+def get_fixture_pids():
+    return sorted(filepath.stem for filepath in EML_FIXTURES_PATH.glob('*.xml'))
+
+
+def use_base_folder(base_path, monkeypatch):
+    # Make a base folder in base_path, as config.py would, and point Config at it
+    data_path = base_path / 'data'
+    eml_files_path = base_path / 'eml_files'
+    snapshot_path = data_path / 'snapshot'
+    possible_dups_path = data_path / 'possible_dups_results'
+    for path in (eml_files_path, snapshot_path, possible_dups_path):
+        path.mkdir(parents=True)
+    for filepath in CORRECTIONS_PATH.glob('*.xml'):
+        shutil.copy(filepath, data_path)
+    for filepath in EML_FIXTURES_PATH.glob('*.xml'):
+        shutil.copy(filepath, eml_files_path)
+    creator_names_path = data_path / 'creator_names.txt'
+    creator_names_path.write_text('{}')
+
+    settings = {
+        'BASE_FOLDER': str(base_path),
+        'DATA_FILES_PATH': str(data_path),
+        'EML_FILES_PATH': str(eml_files_path),
+        'EML_MANIFEST_PATH': str(data_path / 'eml_manifest.txt'),
+        'POSSIBLE_DUPS_FILES_PATH': str(possible_dups_path),
+        'CREATOR_NAMES_PATH': str(creator_names_path),
+        'SNAPSHOT_PATH': str(snapshot_path),
+        'PARSE_CACHE_PATH': str(data_path / 'parse_cache.sqlite3'),
+        'EML_TEXT_DB_PATH': str(data_path / 'eml_text.sqlite3'),
+        'SQLITE_DB_PATH': str(data_path / 'eml_files.sqlite3'),
+        'STORAGE_BACKEND': 'sqlite',
+        'HARVEST_EML_TEXT': False,
+        'READ_ONLY': False
+    }
+    for name, value in settings.items():
+        monkeypatch.setattr(Config, name, value)
+    return base_path
+
+
+@pytest.fixture
+def umbra_paths(tmp_path, monkeypatch):
+    return use_base_folder(tmp_path / 'umbra', monkeypatch)
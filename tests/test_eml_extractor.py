@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: test_eml_extractor
+
+:Synopsis: The streaming lxml extractors find the same things in each EML file as the metapype-based functions in
+    parse_eml that they replace.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+from contextlib import contextmanager
+
+from metapype.model.node import Node
+import pytest
+
+import webapp.creators.eml_extractor as eml_extractor
+import webapp.creators.parse_eml as parse_eml
+
+from conftest import EML_FIXTURES_PATH
+
+EML_FILEPATHS = sorted(EML_FIXTURES_PATH.glob('*.xml'))
+TAXON_RANKS = ('genus', 'species')
+
+
+@contextmanager
+def parse_with_metapype(filepath):
+    node = parse_eml.xml_to_json(str(filepath))
+    try:
+        yield node
+    finally:
+        Node.delete_node_instance(node.id, True)
+
+
+@pytest.mark.parametrize('filepath', EML_FILEPATHS, ids=lambda filepath: filepath.name)
+def test_responsible_parties_match_metapype(filepath):
+    pid = filepath.stem
+    with parse_with_metapype(filepath) as eml_node:
+        expected = parse_eml.get_all_responsible_parties(pid, eml_node)
+    assert expected
+    assert eml_extractor.extract_responsible_parties(pid, str(filepath)) == expected
+
+
+@pytest.mark.parametrize('filepath', EML_FILEPATHS, ids=lambda filepath: filepath.name)
+def test_facets_match_metapype(filepath):
+    with parse_with_metapype(filepath) as eml_node:
+        projects, related_projects = parse_eml.harvest_projects(eml_node)
+        expected = {
+            'dataset_title': parse_eml.get_dataset_title(eml_node),
+            'dataset_abstract': parse_eml.get_dataset_abstract(eml_node),
+            'dataset_keywords': parse_eml.get_keywords(eml_node),
+            'datatable_descriptions': parse_eml.get_data_table_descriptions(eml_node),
+            'dataset_geographic_descriptions': parse_eml.get_dataset_geographic_descriptions(eml_node),
+            'method_step_descriptions': parse_eml.get_method_step_descriptions(eml_node),
+            'projects': ([tuple(project) for project in projects], [tuple(project) for project in related_projects]),
+            # get_all_ranks is asked for a rank at a time, and is only used for these
+            'taxa': {rank: values for rank in TAXON_RANKS if (values := parse_eml.get_all_ranks(eml_node, rank))}
+        }
+    facets = eml_extractor.extract(filepath.stem, str(filepath), list(expected))
+    facets['taxa'] = {rank: values for rank, values in facets['taxa'].items() if rank in TAXON_RANKS}
+    assert facets == expected
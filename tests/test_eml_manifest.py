@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: test_eml_manifest
+
+:Synopsis: The EML manifest records the changes made by the nightly update and repair without the directory being
+    listed again, and is made again from a listing if anyone else has changed the directory.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+import os
+import shutil
+
+from webapp.config import Config
+import webapp.creators.eml_manifest as eml_manifest
+
+from conftest import get_fixture_pids
+
+
+def forbid_listing(monkeypatch):
+    def listdir(*args, **kwargs):
+        raise AssertionError('The EML directory was listed')
+
+    monkeypatch.setattr(os, 'scandir', listdir)
+    monkeypatch.setattr(os, 'listdir', listdir)
+
+
+def add_file(pid, from_pid):
+    shutil.copy(f'{Config.EML_FILES_PATH}/{from_pid}.xml', f'{Config.EML_FILES_PATH}/{pid}.xml')
+
+
+def set_directory_mtime(mtime_ns):
+    os.utime(Config.EML_FILES_PATH, ns=(mtime_ns, mtime_ns))
+
+
+def test_manifest_lists_the_files(umbra_paths):
+    expected = [f'{pid}.xml' for pid in get_fixture_pids()]
+    assert eml_manifest.get_eml_filenames() == expected
+    assert eml_manifest.read_manifest()[1] == expected
+
+
+def test_update_records_changes_without_listing(umbra_paths, monkeypatch):
+    pids = get_fixture_pids()
+    eml_manifest.get_eml_filenames()
+    mtime_ns = eml_manifest.get_directory_mtime()
+    os.remove(f'{Config.EML_FILES_PATH}/{pids[0]}.xml')
+    add_file('edi.999.1', pids[1])
+    # Make sure the changes are seen, however coarse the file system's timestamps
+    set_directory_mtime(mtime_ns + 10 ** 9)
+
+    with monkeypatch.context() as patched:
+        forbid_listing(patched)
+        eml_manifest.update(mtime_ns, ['edi.999.1'], [pids[0]])
+        filenames = eml_manifest.get_eml_filenames()
+        # The nightly update goes on to look for old revisions
+        assert eml_manifest.get_eml_filenames() == filenames
+
+    assert filenames == sorted(f'{pid}.xml' for pid in pids[1:] + ['edi.999.1'])
+    assert filenames == eml_manifest.rebuild()
+
+
+def test_update_lists_directory_changed_by_others(umbra_paths):
+    pids = get_fixture_pids()
+    eml_manifest.get_eml_filenames()
+    manifest_mtime_ns = eml_manifest.get_directory_mtime()
+    # Another process adds a file after the manifest was made, then the caller makes its own change
+    add_file('edi.998.1', pids[0])
+    set_directory_mtime(manifest_mtime_ns + 10 ** 9)
+    mtime_ns = eml_manifest.get_directory_mtime()
+    add_file('edi.999.1', pids[0])
+    set_directory_mtime(manifest_mtime_ns + 2 * 10 ** 9)
+
+    eml_manifest.update(mtime_ns, ['edi.999.1'])
+
+    assert 'edi.998.1.xml' in eml_manifest.get_eml_filenames()
+    assert 'edi.999.1.xml' in eml_manifest.get_eml_filenames()
+
+
+def test_changes_made_without_update_are_seen(umbra_paths):
+    pids = get_fixture_pids()
+    eml_manifest.get_eml_filenames()
+    mtime_ns = eml_manifest.get_directory_mtime()
+    os.remove(f'{Config.EML_FILES_PATH}/{pids[0]}.xml')
+    set_directory_mtime(mtime_ns + 10 ** 9)
+
+    assert f'{pids[0]}.xml' not in eml_manifest.get_eml_filenames()
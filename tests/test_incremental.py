@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: test_incremental
+
+:Synopsis: Incremental updates of the responsible parties tables, and of the names found in them, give the same
+    results as a full rebuild from the same EML files.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+import ast
+import os
+
+from webapp.config import Config
+import webapp.creators.propagate_names as propagate_names
+import webapp.creators.storage as storage
+
+from conftest import get_fixture_pids, use_base_folder
+
+COLUMNS = ('pid', 'rp_type', 'givenname', 'surname', 'organization', 'position', 'address', 'city', 'country',
+           'email', 'url', 'orcid', 'scope', 'identifier')
+
+
+def get_results():
+    # The raw and cleaned rows, less their serial_ids, and the names
+    store = storage.get_storage()
+    query = f"select {', '.join(COLUMNS)} from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME}"
+    raw_rows = sorted(store.stream_rows(query))
+    query = f"select {', '.join(COLUMNS)}, correction_codes, organization_keywords, skip " \
+            f"from {Config.RESPONSIBLE_PARTIES_TABLE_NAME}"
+    cleaned_rows = sorted((*row[:-1], bool(row[-1])) for row in store.stream_rows(query))
+    with open(Config.CREATOR_NAMES_PATH, 'r', encoding='utf-8') as names_file:
+        names = {name: sorted(variants) for name, variants in ast.literal_eval(names_file.read()).items()}
+    return raw_rows, cleaned_rows, names
+
+
+def test_incremental_updates_match_full_rebuild(tmp_path, monkeypatch):
+    use_base_folder(tmp_path / 'full', monkeypatch)
+    propagate_names.gather_and_prepare_data()
+    propagate_names.process_names()
+    full_results = get_results()
+    assert full_results[1] and full_results[2]
+
+    # Start without some of the files, then add them. Adding some of them again, as when the nightly update runs
+    #  twice in a day, mustn't change the results, nor must the ORCIDs propagated by the runs before. Without
+    #  edi.201.1, its creator's ORCID, which is the one a full rebuild propagates to the creator of edi.203.1, is
+    #  missing, and the ORCID of the creator of edi.202.1 is propagated instead.
+    use_base_folder(tmp_path / 'incremental', monkeypatch)
+    added_pids = ['edi.201.1'] + [pid for pid in get_fixture_pids()[::3] if not pid.startswith('edi.')]
+    held_path = tmp_path / 'held'
+    held_path.mkdir()
+    for pid in added_pids:
+        os.replace(f'{Config.EML_FILES_PATH}/{pid}.xml', held_path / f'{pid}.xml')
+    propagate_names.gather_and_prepare_data()
+    propagate_names.process_names()
+    for pid in added_pids:
+        os.replace(held_path / f'{pid}.xml', f'{Config.EML_FILES_PATH}/{pid}.xml')
+    for pids in (added_pids, added_pids[:2]):
+        propagate_names.gather_and_prepare_data(pids, [])
+        propagate_names.process_names()
+
+    assert get_results() == full_results
+
+
+def test_removing_pids_matches_full_rebuild(tmp_path, monkeypatch):
+    removed_pids = get_fixture_pids()[1::4]
+    use_base_folder(tmp_path / 'full', monkeypatch)
+    for pid in removed_pids:
+        os.remove(f'{Config.EML_FILES_PATH}/{pid}.xml')
+    propagate_names.gather_and_prepare_data()
+    propagate_names.process_names()
+    full_results = get_results()
+
+    use_base_folder(tmp_path / 'incremental', monkeypatch)
+    propagate_names.gather_and_prepare_data()
+    propagate_names.process_names()
+    for pid in removed_pids:
+        os.remove(f'{Config.EML_FILES_PATH}/{pid}.xml')
+    propagate_names.gather_and_prepare_data([], removed_pids)
+    propagate_names.process_names()
+
+    assert get_results() == full_results
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+""":Mod: test_repair
+
+:Synopsis: Repairing a PID, which removes it and adds it back in the same update, leaves its harvested text, and its
+    entries in the search index, as they were.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+import pytest
+
+from webapp.config import Config
+import webapp.creators.propagate_names as propagate_names
+import webapp.creators.search_index as search_index
+import webapp.creators.text_store as text_store
+
+PID = 'edi.201.1'
+
+
+def get_postings(pid):
+    with search_index.get_conn() as conn:
+        return sorted(conn.execute("select term, component, tf, length from postings where pid=?", (pid,)))
+
+
+@pytest.fixture
+def harvested(umbra_paths, monkeypatch):
+    monkeypatch.setattr(Config, 'HARVEST_EML_TEXT', True)
+    propagate_names.gather_and_prepare_data()
+    propagate_names.process_names()
+
+
+def test_repair_keeps_harvested_text(harvested):
+    with text_store.get_conn() as conn:
+        text = text_store.get(conn, PID)
+    assert text['dataset_title']
+
+    # As creators.repair does
+    propagate_names.gather_and_prepare_data([PID], [PID])
+
+    with text_store.get_conn() as conn:
+        assert text_store.get(conn, PID) == text
+
+
+def test_repair_keeps_search_index_entries(harvested):
+    postings = get_postings(PID)
+    assert postings
+    assert PID in [result['pid'] for result in search_index.search('snowpack')['pids']]
+
+    propagate_names.gather_and_prepare_data([PID], [PID])
+
+    assert get_postings(PID) == postings
+    assert PID in [result['pid'] for result in search_index.search('snowpack')['pids']]
+
+
+def test_removed_pid_is_dropped(harvested):
+    propagate_names.gather_and_prepare_data([], [PID])
+
+    with text_store.get_conn() as conn:
+        assert text_store.get(conn, PID) is None
+    assert get_postings(PID) == []
+    assert search_index.search('snowpack')['pids'] == []
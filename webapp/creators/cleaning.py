@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: cleaning
+
+:Synopsis:
+    Clean a responsible party record on its way from the raw table to the cleaned responsible parties table.
+    All of the cleaning is done in a single pass over each record, in Python, so each row is written to the
+    database once, already clean. The record is also tagged with its organization keywords here.
+
+    The results are the same as those of the SQL cleaning stages this replaces, which used PostgreSQL's regular
+    expressions. Hence, the whitespace class below is the one PostgreSQL's regular expressions use, not Python's.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import re
+
+import webapp.creators.nlp as nlp
+import webapp.creators.organizations as organizations
+import webapp.creators.utils as utils
+
+WHITESPACE_CLASS = r'\t\n\x0b\x0c\r \u1680\u2000-\u2006\u2008-\u200a\u2028\u2029\u205f\u3000'
+
+MISPLACED_MIDDLE_INITIAL = re.compile(f'[a-zA-Z]\\.[{WHITESPACE_CLASS}][a-zA-Z]+')
+CONSECUTIVE_WHITESPACE = re.compile(f'[{WHITESPACE_CLASS}]+')
+# Text containing characters other than these needs to be normalized
+NEEDS_NORMALIZING = re.compile(r'[^0-9a-zA-Z *\-,/()|@.;"&:#]')
+
+
+def special_cases(s):
+    s = s.replace("¡", "")
+    s = s.replace("!", "")
+    s = s.replace("•", "-")
+    s = s.replace("/", "-")
+    s = s.replace('a€"', "-")
+    s = s.replace('a€¢', "-")
+    s = s.replace("­", "-")
+    s = s.replace("–", "-")
+    s = s.replace('+', '')
+    s = s.replace('?', '')
+    s = s.replace('>', '')
+    s = s.replace('‐', '-')
+    return s
+
+
+def skip_name(givenname, surname):
+    # Names that aren't really names of persons
+    return givenname.startswith('National') or givenname.startswith('(') or givenname.startswith('Center') or \
+        'Manager' in givenname or 'Manager' in surname or 'LTER' in surname or surname == 'Lead PI' or \
+        'USDA' in surname or givenname == ''
+
+
+def fix_misplaced_middle_initial(givenname, surname):
+    # E.g., givenname='James', surname='T. Kirk'
+    if MISPLACED_MIDDLE_INITIAL.match(surname):
+        parts = surname.split(' ')
+        if len(parts) == 2:
+            initial, surname = parts
+            givenname = f'{givenname} {initial}'
+    return givenname, surname
+
+
+def clean_text(text):
+    # Get rid of newlines and multiple consecutive spaces
+    return CONSECUTIVE_WHITESPACE.sub(' ', text).strip(' ')
+
+
+def normalize_text(text):
+    if NEEDS_NORMALIZING.search(text):
+        text = special_cases(nlp.normalize(text))
+    return text
+
+
+def clean_record(record, organization_tagger):
+    # record is a row from the raw table, in the order of responsible_party_rows.RESPONSIBLE_PARTIES_RAW_COLUMNS.
+    #  Returns the cleaned row, with organization_keywords and skip appended.
+    pid, rp_type, givenname, surname, organization, position, address, city, country, email, url, orcid, \
+        scope, identifier = record
+
+    skip = skip_name(givenname, surname)
+
+    givenname, surname = fix_misplaced_middle_initial(givenname, surname)
+    givenname = givenname.replace('.', '')
+    surname = surname.replace('.', '')
+
+    organization = clean_text(organization)
+    position = clean_text(position)
+    address = clean_text(address)
+    if address == ',':
+        address = ''
+
+    organization = normalize_text(organization)
+    position = normalize_text(position)
+    address = normalize_text(address)
+
+    if orcid:
+        orcid = utils.trim_orcid(orcid)
+
+    organization_keywords = None
+    if rp_type == 'creator' and not skip:
+        organization_keywords = organization_tagger.get_keywords(organization, address, email, url)
+
+    return (pid, rp_type, givenname, surname, organization, position, address, city, country, email, url, orcid,
+            scope, identifier, organization_keywords, skip)
+
+
+def clean_records(records):
+    organization_tagger = organizations.init_organization_tagger()
+    for record in records:
+        yield clean_record(record, organization_tagger)
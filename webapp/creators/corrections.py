@@ -18,6 +18,8 @@
 :Created:
     6/1/21
 """
+import hashlib
+
 from lxml import etree
 
 from webapp.config import Config
@@ -132,6 +134,28 @@ class ORCIDCorrection:
         return self._type
 
 
+class Organization:
+    def __init__(self, names, emails, keyword):
+        self._names = names
+        self._emails = emails
+        self._keyword = keyword
+
+    def __repr__(self):
+        return f'{self.keyword}: {self.names} - {self.emails}'
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def emails(self):
+        return self._emails
+
+    @property
+    def keyword(self):
+        return self._keyword
+
+
 def init_person_variants():
     with open(f'{Config.DATA_FILES_PATH}/{Config.PERSON_VARIANTS_FILE}', 'r', encoding='utf-8') as variants_file:
         xml = variants_file.read()
@@ -218,6 +242,37 @@ def init_orcid_corrections():
     return orcid_corrections
 
 
+def init_organizations():
+    with open(f'{Config.DATA_FILES_PATH}/{Config.ORGANIZATIONS_FILE}', 'r', encoding='utf-8') as organizations_file:
+        xml = organizations_file.read()
+
+    organizations = []
+    root = etree.fromstring(xml.encode("utf-8"))
+    organization_elements = root.findall('organization')
+    for organization_element in organization_elements:
+        # Skip empty names and emails. They are not patterns to match.
+        names = [name_element.text for name_element in organization_element.findall('name') if name_element.text]
+        emails = [email_element.text for email_element in organization_element.findall('email') if email_element.text]
+        keyword = organization_element.find('keyword').text
+        organizations.append(Organization(names, emails, keyword))
+    return organizations
+
+
+# Bump this when the cleaning of the responsible parties table changes, so the cleaned table gets rebuilt
+CLEANING_VERSION = 2
+
+
+def get_cleaning_fingerprint():
+    # The cleaned responsible parties table, and the names propagated from it, depend on these corrections files. If
+    #  any of them changes, the table must be rebuilt rather than updated incrementally.
+    fingerprint = hashlib.sha256(str(CLEANING_VERSION).encode('utf-8'))
+    for filename in (Config.ORCID_CORRECTIONS_FILE, Config.OVERRIDES_FILE, Config.ORGANIZATIONS_FILE,
+                     Config.PERSON_VARIANTS_FILE, Config.NICKNAMES_FILE):
+        with open(f'{Config.DATA_FILES_PATH}/{filename}', 'rb') as corrections_file:
+            fingerprint.update(corrections_file.read())
+    return fingerprint.hexdigest()
+
+
 if __name__ == '__main__':
     persons = init_person_variants()
     for person in persons:
@@ -229,4 +284,8 @@ if __name__ == '__main__':
     print()
     override_corrections = init_override_corrections()
     for override_correction in override_corrections:
-        print(override_correction)
\ No newline at end of file
+        print(override_correction)
+    print()
+    organizations = init_organizations()
+    for organization in organizations:
+        print(organization)
\ No newline at end of file
@@ -21,9 +21,20 @@
         Response is a list in JSON format:
             ["McKnight, Diane","McKnight, Diane M","Mcknight, Diane","Mcnight, Diane"]
 
+    To find the data packages, and their creators, whose harvested EML text (titles, abstracts, keywords, etc.) best
+    matches a query, best first:
+        GET creators/search_text?q=<query>&limit=<limit>
+
+        Response is in JSON format:
+            {"pids": [{"pid": "knb-lter-ntl.1.1", "score": 12.3}, ...],
+             "creators": [{"name": "Magnuson, John J", "score": 45.6, "pids": ["knb-lter-ntl.1.1", ...]}, ...]}
+
     To update the database with names for creators of data packages added since the last update:
         POST creators/names
 
+    When Config.READ_ONLY is True, the GET APIs are served from the snapshot saved by a server running normally
+    (see snapshot.py), without a database connection, and the APIs that modify data are refused.
+
 :Author:
     ide
 
@@ -45,9 +56,10 @@ import xml.etree.ElementTree as ET
 
 from webapp.config import Config
 import webapp.creators.corrections as corrections
-import webapp.creators.db as db
-import webapp.creators.download_eml as download_eml
-import webapp.creators.propagate_names as propagate_names
+import webapp.creators.eml_manifest as eml_manifest
+import webapp.creators.search_index as search_index
+import webapp.creators.snapshot as snapshot
+import webapp.creators.storage as storage
 
 creators_bp = Blueprint('creators_bp', __name__)
 
@@ -79,10 +91,19 @@ def log_error(msg):
         print(msg)
 
 
+def read_only_refusal():
+    return 'Not available: this server is running in read-only mode', 405
+
+
 @creators_bp.before_request
 def init_names():
     global creator_names
 
+    if Config.READ_ONLY:
+        # The snapshot's names already include the variants for overridden names
+        creator_names = snapshot.load_creator_names()
+        return
+
     creator_names = {}
 
     with open(f'{Config.DATA_FILES_PATH}/creator_names.txt', 'r', encoding='utf-8-sig') as names_file:
@@ -116,13 +137,7 @@ def save_last_update_date(now):
 
 
 def get_existing_eml_files():
-    filelist = glob.glob(f'{Config.EML_FILES_PATH}/*.xml')
-    package_ids = []
-    for filename in filelist:
-        filename = os.path.basename(filename)
-        root, ext = os.path.splitext(filename)
-        package_ids.append(root)
-    return package_ids
+    return eml_manifest.get_package_ids()
 
 
 def parse_package_id(package_id):
@@ -163,6 +178,9 @@ def delete_old_revisions(removed_package_ids):
 
 
 def get_changes():
+    # The pipeline's modules, and the libraries they use, e.g., textacy, metapype, and aiohttp, are imported where
+    #  they're used rather than at the top, so a worker that only serves the GET APIs doesn't pay to import them
+    import webapp.creators.download_eml as download_eml
     # See what the from date is
     from_date = '2021-10-01'
     last_update_path = f'{Config.DATA_FILES_PATH}/last_update.txt'
@@ -183,7 +201,8 @@ def get_changes():
     package_id_elements = root.findall('./dataPackage/packageId')
     for package_id_element in package_id_elements:
         added_package_ids.append(package_id_element.text)
-    existing_package_ids = get_existing_eml_files()
+    existing_package_ids = set(get_existing_eml_files())
+    mtime_ns = eml_manifest.get_directory_mtime()
     for package_id in added_package_ids:
         if package_id in existing_package_ids:
             continue
@@ -192,7 +211,7 @@ def get_changes():
         # If revision > 1, delete older revisions
         if int(revision) > 1:
             delete_earlier_revisions(existing_package_ids, scope, identifier, revision, removed_package_ids)
-        existing_package_ids.append(package_id)
+        existing_package_ids.add(package_id)
         # Get the EML and save as xml file
         url = f'https://{Config.PASTA_HOST}/package/metadata/eml/{scope}/{identifier}/{revision}'
         log_info(f'getting EML from PASTA:  {url}')
@@ -200,19 +219,26 @@ def get_changes():
         filename = f'{Config.EML_FILES_PATH}/{scope}.{identifier}.{revision}.xml'
         with open(filename, 'w', encoding='utf-8') as xml_file:
             xml_file.write(eml)
+    eml_manifest.update(mtime_ns, added_package_ids, removed_package_ids)
+    mtime_ns = eml_manifest.get_directory_mtime()
     delete_old_revisions(removed_package_ids)
+    eml_manifest.update(mtime_ns, removed_package_ids=removed_package_ids)
     save_last_update_date(now)
     return added_package_ids, removed_package_ids
 
 
 def update_creator_names():
+    import webapp.creators.propagate_names as propagate_names
     log_info(f"update_creator_names")
+    storage.get_storage().reset_query_stats()
     added_package_ids, removed_package_ids = get_changes()
     propagate_names.gather_and_prepare_data(added_package_ids, removed_package_ids)
     propagate_names.process_names()
     _, orphan_pids = find_orphans()
     flush_orphans(orphan_pids)
     init_names()
+    save_snapshot()
+    storage.get_storage().log_query_summary('update_creator_names queries')
     log_info(f"leaving update_creator_names")
 
 
@@ -225,6 +251,8 @@ def names_key(name):
 @creators_bp.route('/names', methods=['GET', 'POST'])
 def names():
     if request.method == 'POST':
+        if Config.READ_ONLY:
+            return read_only_refusal()
         update_creator_names()
     return jsonify(sorted(list(creator_names.keys()), key=names_key)), 200
 
@@ -241,7 +269,15 @@ def variants(name):
 @creators_bp.route('/repair/<pid>', methods=['POST'])
 def repair(pid):
     log_info(f'repair...  pid={pid}')
-
+    if Config.READ_ONLY:
+        return read_only_refusal()
+    import webapp.creators.download_eml as download_eml
+    import webapp.creators.propagate_names as propagate_names
+
+    storage.get_storage().reset_query_stats()
+    # Make the manifest current before we change the EML files
+    eml_manifest.get_eml_filenames()
+    mtime_ns = eml_manifest.get_directory_mtime()
     scope, id, revision = parse_package_id(pid)
     # Remove the existing EML file
     filename = f'{Config.EML_FILES_PATH}/{pid}.xml'
@@ -254,14 +290,9 @@ def repair(pid):
         pass
 
     # Remove responsible parties from the database whose package id is pid
-    conn = db.get_conn()
-    with conn.cursor() as cur:
-        query = f"delete from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where pid='{pid}'"
-        log_info(query)
-        cur.execute(query)
-        query = f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} where pid='{pid}'"
-        log_info(query)
-        cur.execute(query)
+    log_info(f'delete {pid} from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} and '
+             f'{Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME}')
+    storage.get_storage().delete_pids([pid])
 
     # Get the EML and save as xml file
     url = f'https://{Config.PASTA_HOST}/package/metadata/eml/{scope}/{id}/{revision}'
@@ -270,12 +301,15 @@ def repair(pid):
     filename = f'{Config.EML_FILES_PATH}/{scope}.{id}.{revision}.xml'
     with open(filename, 'w', encoding='utf-8') as xml_file:
         xml_file.write(eml)
+    eml_manifest.update(mtime_ns, added_package_ids, removed_package_ids)
 
     propagate_names.gather_and_prepare_data(added_package_ids, removed_package_ids)
     propagate_names.process_names()
     _, orphan_pids = find_orphans()
     flush_orphans(orphan_pids)
     init_names()
+    save_snapshot()
+    storage.get_storage().log_query_summary(f'repair {pid} queries')
     return f'Package "{pid}" repaired', 200
 
 
@@ -309,61 +343,46 @@ def get_old_dups():
 
 
 def flush_orphans(orphan_pids):
-    conn = db.get_conn()
-
-    with conn.cursor() as cur:
-        for pid in orphan_pids:
-            query = f"delete from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                    f"where pid='{pid}'"
-            cur.execute(query)
-            query = f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} " \
-                    f"where pid='{pid}'"
-            cur.execute(query)
+    if orphan_pids:
+        storage.get_storage().delete_pids(orphan_pids)
 
 
 def find_orphans():
     # Get a list of PIDs for which we have EML files
-    pids = []
-    filelist = sorted(glob.glob(f'{Config.EML_FILES_PATH}/*.xml'))
-    if filelist:
-        for filename in filelist:
-            pids.append(os.path.basename(filename.replace('.xml', '')))
+    pids = get_existing_eml_files()
 
     # Search for creators having one of those PIDs. I.e., creators that should have been removed or replaced but weren't
-    conn = db.get_conn()
-
     orphans = []
     orphan_pids = set()
     creators = {}
-    with conn.cursor() as cur:
-        query = f"select serial_id, surname, givenname, pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                f"where rp_type='creator'"
-        cur.execute(query)
-        results = cur.fetchall()
-        for result in results:
-            serial_id, surname, givenname, pid = result
-            scope, id, _ = parse_package_id(pid)
-            creators_for_pid = creators.get((scope, id), [])
-            creators_for_pid.append(result)
-            creators[(scope, id)] = creators_for_pid
-
-        for pid in pids:
-            scope, id, revision = parse_package_id(pid)
-            creators_for_pid = creators.get((scope, id), [])
-            if not creators_for_pid:
-                continue
-            for result in creators_for_pid:
-                serial_id, surname, givenname, result_pid = result
-                _, _, result_revision = parse_package_id(result_pid)
-                if revision != result_revision:
-                    orphans.append(result)
-                    orphan_pids.add(f"{scope}.{id}.{result_revision}")
+    query = f"select serial_id, surname, givenname, pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+            f"where rp_type='creator'"
+    for result in storage.get_storage().stream_rows(query):
+        serial_id, surname, givenname, pid = result
+        scope, id, _ = parse_package_id(pid)
+        creators_for_pid = creators.get((scope, id), [])
+        creators_for_pid.append(result)
+        creators[(scope, id)] = creators_for_pid
+
+    for pid in pids:
+        scope, id, revision = parse_package_id(pid)
+        creators_for_pid = creators.get((scope, id), [])
+        if not creators_for_pid:
+            continue
+        for result in creators_for_pid:
+            serial_id, surname, givenname, result_pid = result
+            _, _, result_revision = parse_package_id(result_pid)
+            if revision != result_revision:
+                orphans.append(result)
+                orphan_pids.add(f"{scope}.{id}.{result_revision}")
     return orphans, orphan_pids
 
 
 @creators_bp.route('/orphans', methods=['GET', 'POST'])
 def orphans():
     log_info(f'orphans...  method={request.method}')
+    if Config.READ_ONLY:
+        return read_only_refusal()
 
     orphans, orphan_pids = find_orphans()
 
@@ -379,14 +398,20 @@ def orphans():
 def possible_dups():
     log_info(f'possible_dups...  method={request.method}')
     if request.method == 'POST':
+        if Config.READ_ONLY:
+            return read_only_refusal()
         flush_old_dups()
+        snapshot.save_old_dups(get_old_dups())
         return 'Flush completed', 200
 
     output = []
     marked_output = []
     names = sorted(list(creator_names.keys()), key=names_key)
     prev_surname = None
-    old_dups = get_old_dups()
+    if Config.READ_ONLY:
+        old_dups = snapshot.load_old_dups()
+    else:
+        old_dups = get_old_dups()
     givennames = []
     for name in names:
         try:
@@ -413,11 +438,8 @@ def possible_dups():
             givennames.append(givenname)
 
     # Save output in a file for comparison later
-    timestamp = datetime.now().date().strftime('%Y_%m_%d') + '__' + datetime.now().time().strftime('%H_%M_%S')
-    filename = f"possible_dups_{timestamp}.txt"
-    os.makedirs(f"{Config.POSSIBLE_DUPS_FILES_PATH}/", exist_ok=True)
-    with open(f"{Config.POSSIBLE_DUPS_FILES_PATH}/{filename}", 'w', encoding='utf-8') as dups_file:
-        dups_file.write(str(jsonify(output).json))
+    if not Config.READ_ONLY:
+        save_possible_dups(output)
 
     # Go thru and get all the lines with change markers and prepend them to the output
     changes = []
@@ -428,8 +450,33 @@ def possible_dups():
     return jsonify(marked_output)
 
 
+def save_possible_dups(output):
+    timestamp = datetime.now().date().strftime('%Y_%m_%d') + '__' + datetime.now().time().strftime('%H_%M_%S')
+    filename = f"possible_dups_{timestamp}.txt"
+    os.makedirs(f"{Config.POSSIBLE_DUPS_FILES_PATH}/", exist_ok=True)
+    with open(f"{Config.POSSIBLE_DUPS_FILES_PATH}/{filename}", 'w', encoding='utf-8') as dups_file:
+        dups_file.write(str(jsonify(output).json))
+    # The oldest saved list is the one used for comparison, so it changes only if this is the first one saved
+    snapshot.save_old_dups(get_old_dups())
+
+
+@creators_bp.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    import webapp.creators.db as db
+    return jsonify(db.get_pool_stats()), 200
+
+
+@creators_bp.route('/query_stats', methods=['GET'])
+def query_stats():
+    import webapp.creators.db as db
+    return jsonify(db.get_query_stats()), 200
+
+
 @creators_bp.route('/init_raw_db', methods=['POST'])
 def init_raw_db():
+    if Config.READ_ONLY:
+        return read_only_refusal()
+    import webapp.creators.propagate_names as propagate_names
     propagate_names.init_responsible_parties_raw_db()
     return f'Table {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} has been initialized', 200
 
@@ -449,29 +496,14 @@ def create_creator_names_reverse_lookup():
 def check_scope_existence(scope):
     scope = scope.lower()
 
-    conn = db.get_conn()
-    with conn.cursor() as cur:
-        query = f"select scope from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                f"where scope='{scope}' limit 1"
-        cur.execute(query)
-        return len(cur.fetchall()) > 0
-
-
-def get_creators_for_scope(scope):
-    global creator_names
-
-    init_names()
-    create_creator_names_reverse_lookup()
+    if Config.READ_ONLY:
+        return scope in snapshot.load_names_for_scope()
 
-    conn = db.get_conn()
+    query = f"select scope from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where scope=%s limit 1"
+    return len(storage.get_storage().fetch_rows(query, (scope,))) > 0
 
-    scope = scope.lower()
-    with conn.cursor() as cur:
-        query = f"select surname, givenname from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                f"where rp_type='creator' and scope='{scope}'"
-        cur.execute(query)
-        names_in_scope = set(cur.fetchall())
 
+def get_canonical_names(names_in_scope):
     canonical_names_in_scope = set()
     names_in_scope = set([f"{name[0]}, {name[1]}" for name in names_in_scope])
     # print('raw_names_in_scope', len(names_in_scope))
@@ -490,6 +522,58 @@ def get_creators_for_scope(scope):
     return sorted(canonical_names_in_scope, key=names_key)
 
 
+def get_creators_for_scope(scope):
+    global creator_names
+
+    scope = scope.lower()
+    if Config.READ_ONLY:
+        return snapshot.load_names_for_scope().get(scope, [])
+
+    init_names()
+    create_creator_names_reverse_lookup()
+
+    query = f"select surname, givenname from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+            f"where rp_type='creator' and scope=%s"
+    names_in_scope = set(storage.get_storage().fetch_rows(query, (scope,)))
+
+    return get_canonical_names(names_in_scope)
+
+
+def get_creators_for_all_scopes():
+    create_creator_names_reverse_lookup()
+
+    names_by_scope = {}
+    # Include scopes that have no creators, so check_scope_existence can be answered from the result
+    query = f"select distinct scope from {Config.RESPONSIBLE_PARTIES_TABLE_NAME}"
+    for scope, in storage.get_storage().stream_rows(query):
+        names_by_scope[scope] = set()
+    query = f"select distinct scope, surname, givenname from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+            f"where rp_type='creator'"
+    for scope, surname, givenname in storage.get_storage().stream_rows(query):
+        names_by_scope[scope].add((surname, givenname))
+
+    return {scope: get_canonical_names(names_in_scope) for scope, names_in_scope in names_by_scope.items()}
+
+
+def get_creators_for_all_pids():
+    create_creator_names_reverse_lookup()
+
+    names_by_pid = {}
+    query = f"select distinct pid, surname, givenname from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+            f"where rp_type='creator'"
+    for pid, surname, givenname in storage.get_storage().stream_rows(query):
+        names_by_pid.setdefault(pid, set()).add((surname, givenname))
+
+    return {pid: get_canonical_names(names) for pid, names in names_by_pid.items()}
+
+
+def save_snapshot():
+    # Assumes init_names() has been called, so creator_names includes the variants for overridden names
+    log_info('save_snapshot')
+    snapshot.save_snapshot(creator_names, get_creators_for_all_scopes(), get_old_dups())
+    search_index.save_creators(get_creators_for_all_pids())
+
+
 @creators_bp.route('/names_for_scope/<scope>', methods=['GET'])
 def names_for_scope(scope):
     if not check_scope_existence(scope):
@@ -497,6 +581,17 @@ def names_for_scope(scope):
     return jsonify(get_creators_for_scope(scope))
 
 
+@creators_bp.route('/search_text', methods=['GET'])
+def search_text():
+    query = request.args.get('q', '')
+    if not query.strip():
+        return 'Query parameter q is required', 400
+    try:
+        return jsonify(search_index.search(query, request.args.get('limit', type=int)))
+    except FileNotFoundError:
+        return 'Search index not found', 400
+
+
 def print_list(l):
     for item in l:
         print(item)
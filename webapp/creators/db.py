@@ -15,306 +15,707 @@
     6/1/21
 """
 
+import concurrent.futures
+from contextlib import contextmanager
+from datetime import datetime
+import heapq
+import itertools
+import os
+import re
+import threading
+import time
+
+import daiquiri
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 
 from webapp.config import Config
+import webapp.creators.cleaning as cleaning
 import webapp.creators.corrections as corrections
+import webapp.creators.responsible_party_rows as responsible_party_rows
 
-import webapp.creators.nlp as nlp
-import webapp.creators.utils as utils
+logger = daiquiri.getLogger(Config.LOG_FILE)
 
 
-def get_conn():
-    conn = psycopg2.connect(f'dbname={Config.DB_NAME} user={Config.DB_USER} host={Config.DB_HOST} password={Config.DB_PASSWORD}')
-    conn.autocommit = True
-    return conn
+# ------------------------------------------------------------------------------------------------
+# Query instrumentation
+#
+# The pool's connections create InstrumentedCursors, which time each statement and record the counts, total and
+#  maximum durations, and rows affected by statement template, i.e., the statement with its literal values replaced
+#  by ?s. A named cursor's statement is timed when it's declared, not as its rows are fetched.
+# ------------------------------------------------------------------------------------------------
 
+QUERY_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+# E.g., the pages of values sent by execute_values
+VALUES_LISTS = re.compile(r"\([^()]*\)(?:, ?\([^()]*\))+")
+EXPLAINABLE_STATEMENTS = ('select', 'insert', 'update', 'delete', 'with')
+QUERY_SUMMARY_LENGTH = 20
+
+query_stats = {}
+explained_templates = set()
+query_stats_lock = threading.Lock()
+
+
+def statement_template(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    template = QUERY_LITERALS.sub('?', ' '.join(query.split()))
+    return VALUES_LISTS.sub('(...)', template)
+
+
+def record_query(query, seconds, rowcount):
+    template = statement_template(query)
+    with query_stats_lock:
+        stats = query_stats.setdefault(template, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'rows': 0})
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        stats['rows'] += max(rowcount, 0)
+        explain = Config.EXPLAIN_SLOW_QUERIES and template not in explained_templates
+        if explain:
+            explained_templates.add(template)
+    return template, explain
+
+
+def explain_query(conn, query, params):
+    # EXPLAIN ANALYZE runs the statement, so it's run again in a transaction, or a savepoint, that's rolled back.
+    #  A plain cursor is used, so the caller's cursor keeps its results.
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    if not query.lstrip().lower().startswith(EXPLAINABLE_STATEMENTS):
+        return None
+    in_transaction = not conn.autocommit
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("savepoint explain_query" if in_transaction else "begin")
+        try:
+            cur.execute(f"explain (analyze, buffers) {query}", params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as e:
+            plan = f'Not explained: {e}'
+        finally:
+            cur.execute("rollback to savepoint explain_query" if in_transaction else "rollback")
+    return plan
+
+
+def log_slow_query(template, seconds, rowcount, plan=None):
+    with query_stats_lock:
+        with open(Config.SLOW_QUERY_LOG_FILE, 'a', encoding='utf-8') as log_file:
+            log_file.write(f'{datetime.now().isoformat(timespec="seconds")} [PID {os.getpid()}] '
+                           f'{seconds:.3f}s {rowcount} rows: {template}\n')
+            if plan:
+                log_file.write(''.join(f'    {line}\n' for line in plan.split('\n')))
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.record(query, vars, time.perf_counter() - start)
 
-def get_all_pids():
-    conn = get_conn()
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self.record(sql, None, time.perf_counter() - start)
 
-    with conn.cursor() as cur:
-        query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} order by pid"
-        cur.execute(query)
-        results = cur.fetchall()
-    return [result[0] for result in results]
+    def record(self, query, vars, seconds):
+        template, explain = record_query(query, seconds, self.rowcount)
+        if Config.SLOW_QUERY_SECONDS is not None and seconds >= Config.SLOW_QUERY_SECONDS:
+            plan = None
+            if explain and self.name is None and not self.connection.closed and \
+                    self.connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+                plan = explain_query(self.connection, query, vars)
+            log_slow_query(template, seconds, self.rowcount, plan)
 
 
-def get_pids_by_name(givenname, surname):
-    conn = get_conn()
+def get_query_stats():
+    with query_stats_lock:
+        return {template: dict(stats) for template, stats in query_stats.items()}
+
+
+def reset_query_stats():
+    with query_stats_lock:
+        query_stats.clear()
+        explained_templates.clear()
 
-    with conn.cursor() as cur:
-        givenname = givenname.replace("'", "''")
-        surname = surname.replace("'", "''")
-        query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                f"where givenname='{givenname}' and surname='{surname}' order by pid"
-        cur.execute(query)
-        results = cur.fetchall()
-    return [result[0] for result in results]
+
+def log_query_summary(title):
+    # Log the statement templates that took the most time in all
+    stats = get_query_stats()
+    count = sum(template_stats['count'] for template_stats in stats.values())
+    seconds = sum(template_stats['total_seconds'] for template_stats in stats.values())
+    logger.info(f'{title}: {count} statements, {len(stats)} templates, {seconds:.3f}s')
+    by_total = sorted(stats.items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+    for template, template_stats in by_total[:QUERY_SUMMARY_LENGTH]:
+        logger.info(f"    {template_stats['total_seconds']:9.3f}s total {template_stats['max_seconds']:8.3f}s max "
+                    f"{template_stats['count']:7d} statements {template_stats['rows']:9d} rows: {template[:200]}")
 
 
 # ------------------------------------------------------------------------------------------------
-# Building the raw responsible party database table
+# Connection pool
 # ------------------------------------------------------------------------------------------------
 
-def find_entries(line, tag):
-    entries = []
-    for item in line:
-        if item[0] == tag:
-            entries.append(item[1])
-    return ' '.join(entries)
+# The pool is created on first use in each process. uWSGI forks its workers from the master process, and a worker
+#  must not use connections it inherited from the master, since they share the master's sockets.
+pool = None
+pool_pid = None
+pool_semaphore = None
+pool_lock = threading.Lock()
+# Pools inherited across a fork are kept here, never closed, so that garbage-collecting their connections doesn't
+#  terminate the sessions still in use by the parent process.
+inherited_pools = []
+pool_stats = {}
+
+
+def init_pool_stats():
+    global pool_stats
+
+    pool_stats = {
+        'pid': os.getpid(),
+        'min_conn': Config.DB_POOL_MIN_CONN,
+        'max_conn': Config.DB_POOL_MAX_CONN,
+        'in_use': 0,
+        'max_in_use': 0,
+        'checkouts': 0,
+        'waits': 0,
+        'wait_seconds': 0.0,
+        'timeouts': 0,
+        'discarded': 0
+    }
+
+
+def get_pool():
+    global pool, pool_pid, pool_semaphore
+
+    with pool_lock:
+        if pool is None or pool_pid != os.getpid():
+            if pool is not None:
+                inherited_pools.append(pool)
+            pool = psycopg2.pool.ThreadedConnectionPool(
+                Config.DB_POOL_MIN_CONN,
+                Config.DB_POOL_MAX_CONN,
+                f'dbname={Config.DB_NAME} user={Config.DB_USER} host={Config.DB_HOST} password={Config.DB_PASSWORD}',
+                cursor_factory=InstrumentedCursor)
+            pool_semaphore = threading.BoundedSemaphore(Config.DB_POOL_MAX_CONN)
+            pool_pid = os.getpid()
+            init_pool_stats()
+    return pool
+
+
+def update_pool_stats(**increments):
+    with pool_lock:
+        for key, increment in increments.items():
+            pool_stats[key] += increment
+        pool_stats['max_in_use'] = max(pool_stats['max_in_use'], pool_stats['in_use'])
+
+
+def checkout_conn():
+    conn_pool = get_pool()
+    semaphore = pool_semaphore
+    # ThreadedConnectionPool raises an error when all of its connections are in use, so we wait our turn here
+    if not semaphore.acquire(blocking=False):
+        start = time.perf_counter()
+        acquired = semaphore.acquire(timeout=Config.DB_POOL_TIMEOUT)
+        update_pool_stats(waits=1, wait_seconds=time.perf_counter() - start, timeouts=0 if acquired else 1)
+        if not acquired:
+            raise psycopg2.pool.PoolError(f'No database connection became available in {Config.DB_POOL_TIMEOUT} seconds')
+    try:
+        conn = conn_pool.getconn()
+        if conn.closed:
+            # The server closed it while it sat in the pool
+            conn_pool.putconn(conn, close=True)
+            update_pool_stats(discarded=1)
+            conn = conn_pool.getconn()
+    except Exception:
+        semaphore.release()
+        raise
+    update_pool_stats(checkouts=1, in_use=1)
+    return conn_pool, semaphore, conn
+
+
+def return_conn(conn_pool, semaphore, conn):
+    if conn_pool is not pool:
+        # Checked out before a fork, from the parent's pool, which this process no longer uses
+        return
+    # The pool rolls back any transaction left open, so the next user gets a clean connection
+    closed = bool(conn.closed)
+    conn_pool.putconn(conn, close=closed)
+    update_pool_stats(in_use=-1, discarded=1 if closed else 0)
+    semaphore.release()
+
+
+@contextmanager
+def get_conn(autocommit=True):
+    # Check out a connection from the process-wide pool, returning it to the pool on exit. With autocommit=False,
+    #  the work done on the connection is committed as a single transaction on exit, or rolled back on an exception.
+    conn_pool, semaphore, conn = checkout_conn()
+    try:
+        conn.autocommit = autocommit
+        yield conn
+        if not autocommit:
+            conn.commit()
+    except Exception:
+        if not autocommit and not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        return_conn(conn_pool, semaphore, conn)
+
+
+def get_pool_stats():
+    with pool_lock:
+        if pool is None or pool_pid != os.getpid():
+            return {'pid': os.getpid(), 'min_conn': Config.DB_POOL_MIN_CONN, 'max_conn': Config.DB_POOL_MAX_CONN,
+                    'open': 0, 'in_use': 0}
+        stats = dict(pool_stats)
+        stats['open'] = len(pool._pool) + len(pool._used)
+    return stats
 
 
-def parse_responsible_parties_file(filename):
-    filepath = f'{Config.EML_FILES_PATH}/{filename}'
-    try:
-        with open(filepath, 'r', encoding='utf-8') as rp_file:
-            lines = rp_file.read().split('\n')
-    except FileNotFoundError:
-        lines = []
-    responsible_parties = {}
-    for line in lines:
-        try:
-            pid, *_ = eval(line)
-        except:
-            continue
-        pid_lines = responsible_parties.get(pid, set())
-        pid_lines.add(line)
-        responsible_parties[pid] = pid_lines
-    return responsible_parties
-
-
-def prune_pids(responsible_parties, pids_to_remove):
-    # As PIDs are removed (older revisions, for example), remove their entries from the database
-    if pids_to_remove:
-        for pid in pids_to_remove:
-            responsible_parties.pop(pid, None)
-
-
-def insert_responsible_party_raw(conn, pid=None, rp_type=None, givenname=None, surname=None,
-                                 organization=None, position=None, address=None, city=None,
-                                 country=None, email=None, url=None, orcid=None,
-                                 scope=None, identifier=None):
-    cur = conn.cursor()
-    sql = f"INSERT INTO {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} VALUES ('{pid}','{rp_type}'," + \
-        f"'{givenname}','{surname}','{organization}','{position}','{address}','{city}','{country}'," \
-        f" '{email}','{url}','{orcid}','{scope}',{identifier})"
-    cur.execute(sql)
-    conn.commit()
-
-
-def remove_duplicate_records(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    conn = get_conn()
+# ------------------------------------------------------------------------------------------------
+# Streaming reads
+# ------------------------------------------------------------------------------------------------
 
-    with conn.cursor() as cur:
-        sql = f"delete from {table_name} T1 using {table_name} T2 where T1.ctid<T2.ctid and " \
-              f"T1.givenname = T2.givenname and T1.surname = T2.surname and T1.pid = T2.pid and T1.rp_type = T2.rp_type"
-        cur.execute(sql)
-        conn.commit()
+STREAM_ITERSIZE = 5000
+stream_cursor_ids = itertools.count()
 
 
-def build_responsible_party_raw_db(filename, added_package_ids=None):
-    if added_package_ids == []:
-        return
+def stream_rows(query, params=None, itersize=STREAM_ITERSIZE):
+    # Yield the query's results through a named, server-side cursor, which fetches them itersize rows at a time,
+    #  so the whole result set is never held in memory. The connection is held until the generator is exhausted
+    #  or closed.
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor(name=f'stream_{os.getpid()}_{next(stream_cursor_ids)}') as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            for row in cur:
+                yield row
 
-    conn = get_conn()
 
-    filepath = f'{Config.EML_FILES_PATH}/{filename}'
-    with open(filepath, 'r', encoding='utf-8') as rp_file:
-        lines = rp_file.read().split('\n')
-    for line in lines:
-        try:
-            pid, rp_type, vals = eval(line)
-        except:
-            continue
-        if added_package_ids and pid not in added_package_ids:
-            continue
-        givenname = find_entries(vals, 'givenName').replace("'", "''")
-        surname = find_entries(vals, 'surName').replace("'", "''")  # FIXME
-        organization = find_entries(vals, 'organizationName').replace("'", "''")
-        position = find_entries(vals, 'positionName').replace("'", "''")
-        address = find_entries(vals, 'deliveryPoint').replace("'", "''")
-        city = find_entries(vals, 'city').replace("'", "")
-        country = find_entries(vals, 'country').replace("'", "")
-        email = find_entries(vals, 'electronicMailAddress').replace("'", "''")
-        url = find_entries(vals, 'onlineUrl').replace("'", "''")
-        orcid = find_entries(vals, 'userId')
-        scope, identifier, version = pid.split('.')
-
-        insert_responsible_party_raw(conn, pid, rp_type, givenname, surname, organization, position, address,
-                                     city, country, email, url, orcid, scope, identifier)
+def fetch_rows(query, params=None):
+    # For small results, e.g., point lookups, which would only pay for a server-side cursor's extra round trips
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
 
 
-def init_responsible_parties_table(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
-                                   raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME):
-    conn = get_conn()
+# ------------------------------------------------------------------------------------------------
 
-    with conn.cursor() as cur:
-        query = f"truncate {table_name} restart identity"
-        cur.execute(query)
 
-        query = f"insert into {table_name} (pid, rp_type, givenname, surname, organization, position, address, city, country, email, url, orcid, scope, identifier) " \
-                f"(select pid, rp_type, givenname, surname, organization, position, address, city, country, email, url, orcid, scope, identifier FROM {raw_table_name})"
-        cur.execute(query)
+def analyze(table_name):
+    # Refresh the planner's statistics after a bulk load, so it uses the indexes
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"analyze {table_name}")
 
-        query = f"update {table_name} set skip=false"
-        cur.execute(query)
-        query = f"update {table_name} set skip=true " \
-                f" where givenname like 'National%' or givenname like '(%' or givenname  like 'Center%'or givenname like '%Manager%' or surname like '%Manager%' or " \
-                f" surname like '%LTER%' or surname = 'Lead PI' or surname like '%USDA%' or givenname = ''"
-        cur.execute(query)
+
+def get_all_pids():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} order by pid"
+            cur.execute(query)
+            results = cur.fetchall()
+    return [result[0] for result in results]
 
 
+def get_pids_by_name(givenname, surname):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            givenname = givenname.replace("'", "''")
+            surname = surname.replace("'", "''")
+            query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+                    f"where givenname='{givenname}' and surname='{surname}' order by pid"
+            cur.execute(query)
+            results = cur.fetchall()
+    return [result[0] for result in results]
+
+
+# ------------------------------------------------------------------------------------------------
+# Bulk loading with COPY
 # ------------------------------------------------------------------------------------------------
 
+RESPONSIBLE_PARTIES_RAW_COLUMNS = responsible_party_rows.RESPONSIBLE_PARTIES_RAW_COLUMNS
+RESPONSIBLE_PARTIES_COLUMNS = responsible_party_rows.RESPONSIBLE_PARTIES_COLUMNS
 
-def fix_misplaced_middle_initials(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    conn = get_conn()
 
-    with conn.cursor() as cur:
-        query = f"select serial_id, surname, givenname from {table_name} where surname ~* '^[a-z]\.\s[a-z]+\s*'"
-        cur.execute(query)
-        results = cur.fetchall()
-        for serial_id, surname, givenname in results:
-            initial, surname = surname.split(' ')
-            givenname = f"{givenname} {initial}".replace("'", "''")
-            surname = surname.replace("'", "''")
-            query = f"update {table_name} set surname='{surname}', givenname='{givenname}' where serial_id={serial_id}"
+def copy_text(value):
+    # Format a value for COPY's text format, where None is NULL and backslash, tab, and newline must be escaped
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class CopyRowsReader:
+    # A file-like object that reads the rows from an iterable in COPY's text format, so rows can be streamed to
+    #  the database as they are generated, without building the whole input in memory
+    def __init__(self, rows):
+        self._lines = ('\t'.join(copy_text(value) for value in row) + '\n' for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def copy_rows(cur, table_name, columns, rows):
+    copy_sql = f"copy {table_name} ({', '.join(columns)}) from stdin"
+    cur.copy_expert(copy_sql, CopyRowsReader(rows))
+
+
+# ------------------------------------------------------------------------------------------------
+# Building the raw responsible party database table
+# ------------------------------------------------------------------------------------------------
+
+def load_raw_rows(rows, pids_to_delete=None):
+    # The rows for the PIDs to delete are deleted and the new rows loaded in a single transaction
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            if pids_to_delete:
+                query = f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} where pid = any(%s)"
+                cur.execute(query, (list(pids_to_delete),))
+            copy_rows(cur, Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME, RESPONSIBLE_PARTIES_RAW_COLUMNS, rows)
+
+
+def clear_raw_rows():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME}"
             cur.execute(query)
 
 
-def clean_text_field(cur, colname, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+def delete_pids(pids):
+    # Delete the PIDs' rows from both the cleaned and the raw tables
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            for table_name in (Config.RESPONSIBLE_PARTIES_TABLE_NAME, Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME):
+                query = f"delete from {table_name} where pid = any(%s)"
+                cur.execute(query, (list(pids),))
 
-    # Get rid of newlines
-    query = f"update {table_name} set {colname} = trim(regexp_replace({colname}, '\n', ' ', 'g'))"
-    cur.execute(query)
 
-    # Get rid of multiple consecutive spaces
-    query = f"update {table_name} set {colname} = trim(regexp_replace({colname}, '\s+', ' ', 'g'))"
-    cur.execute(query)
+def init_responsible_parties_table(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                   raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME, pids=None,
+                                   workers=None):
+    # Copy the raw rows into the table, cleaning them on the way. If pids is given, only the raw rows for those PIDs
+    #  are copied. A full table of at least CLEANING_PARTITION_MIN_ROWS rows is cleaned by several processes at once.
+    if pids is None:
+        workers = get_cleaning_workers(workers)
+        if workers > 1 and count_rows(raw_table_name) >= Config.CLEANING_PARTITION_MIN_ROWS:
+            init_responsible_parties_table_in_partitions(table_name, raw_table_name, workers)
+            return
+    pid_condition = ''
+    params = None
+    if pids is not None:
+        pid_condition = ' where pid = any(%s)'
+        params = (list(pids),)
+    query = f"select {', '.join(RESPONSIBLE_PARTIES_RAW_COLUMNS)} from {raw_table_name}{pid_condition}"
+    raw_rows = stream_rows(query, params)
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = f"truncate {table_name} restart identity"
+            cur.execute(query)
+            copy_rows(cur, table_name, RESPONSIBLE_PARTIES_RAW_COLUMNS + ('organization_keywords', 'skip'),
+                      cleaning.clean_records(raw_rows))
 
 
-def clean_database_text(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    conn = get_conn()
+# ------------------------------------------------------------------------------------------------
+# Cleaning in partitions
+#
+# The cleaning is done in Python, row by row, and the rows of different scopes are independent, so the raw table
+#  is partitioned by scope and the partitions are cleaned by separate processes, each with its own connections.
+#  The scopes are assigned to the partitions largest first, each to the partition with the fewest rows so far, to
+#  balance them. Each partition's rows are given a block of serial_ids, in order, so the result doesn't depend on
+#  the order in which the partitions finish.
+# ------------------------------------------------------------------------------------------------
 
-    with conn.cursor() as cur:
-        query = f"select serial_id, orcid from {table_name} where orcid <> ''"
-        cur.execute(query)
+def get_cleaning_workers(workers=None):
+    if workers is None:
+        workers = Config.CLEANING_WORKERS or os.cpu_count() or 1
+    return max(workers, 1)
+
+
+def partition_scopes(scope_counts, partitions):
+    # Returns [(scopes, row count), ...], omitting empty partitions
+    heap = [(0, index, []) for index in range(partitions)]
+    for scope, count in sorted(scope_counts, key=lambda scope_count: (-scope_count[1], scope_count[0])):
+        total, index, scopes = heapq.heappop(heap)
+        scopes.append(scope)
+        heapq.heappush(heap, (total + count, index, scopes))
+    return [(scopes, total) for total, _, scopes in sorted(heap, key=lambda partition: partition[1]) if scopes]
+
+
+def clean_partition(table_name, raw_table_name, scopes, first_serial_id):
+    query = f"select {', '.join(RESPONSIBLE_PARTIES_RAW_COLUMNS)} from {raw_table_name} where scope = any(%s)"
+    raw_rows = stream_rows(query, (scopes,))
+    rows = ((serial_id, *row) for serial_id, row in enumerate(cleaning.clean_records(raw_rows), first_serial_id))
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            copy_rows(cur, table_name, ('serial_id',) + RESPONSIBLE_PARTIES_RAW_COLUMNS +
+                      ('organization_keywords', 'skip'), rows)
+            return cur.rowcount
+
+
+def init_responsible_parties_table_in_partitions(table_name, raw_table_name, workers):
+    query = f"select scope, count(*) from {raw_table_name} group by scope"
+    partitions = partition_scopes(list(stream_rows(query)), workers)
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = f"truncate {table_name} restart identity"
+            cur.execute(query)
+    first_serial_ids = itertools.accumulate([1] + [count for _, count in partitions[:-1]])
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(partitions)) as executor:
+        futures = [executor.submit(clean_partition, table_name, raw_table_name, scopes, first_serial_id)
+                   for (scopes, _), first_serial_id in zip(partitions, first_serial_ids)]
+        for future in futures:
+            future.result()
+    # The serial_ids were given explicitly, so the table's sequence has to be moved past them
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = f"select setval(pg_get_serial_sequence(%s, 'serial_id'), coalesce(max(serial_id), 0) + 1, false) " \
+                    f"from {table_name}"
+            cur.execute(query, (table_name,))
 
-        # Clean periods from names
-        query = f"update {table_name} set givenname=translate(givenname, '.', '')"
-        cur.execute(query)
-        query = f"update {table_name} set surname=translate(surname, '.', '')"
-        cur.execute(query)
 
-        # Clean newlines and multiple consecutive spaces in organization, position, and address
-        clean_text_field(cur, 'organization')
-        clean_text_field(cur, 'position')
-        clean_text_field(cur, 'address')
+# ------------------------------------------------------------------------------------------------
 
-        # Clear address if it's just a comma
-        query = f"update {table_name} set address='' where address=','"
-        cur.execute(query)
 
+def replace_responsible_parties(pids, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                staging_table_name=Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME):
+    # Replace the rows for the given PIDs with the cleaned rows in the staging table, in a single transaction
+    columns = ', '.join(RESPONSIBLE_PARTIES_COLUMNS)
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = f"delete from {table_name} where pid = any(%s)"
+            cur.execute(query, (list(pids),))
+            query = f"insert into {table_name} ({columns}) (select {columns} from {staging_table_name})"
+            cur.execute(query)
+            query = f"truncate {staging_table_name}"
+            cur.execute(query)
 
-def clean_responsible_party_orcids(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    conn = get_conn()
 
-    with conn.cursor() as cur:
-        query = f"select serial_id, orcid from {table_name} where orcid <> ''"
-        cur.execute(query)
-        nonempty_orcids = cur.fetchall()
+# ------------------------------------------------------------------------------------------------
+# Rebuilding the responsible parties table in a shadow table
+#
+# A full rebuild is done in a shadow table, which is then swapped for the live table in a single transaction,
+#  so readers of the live table never see it empty or partly cleaned, and a failed rebuild leaves it untouched.
+# ------------------------------------------------------------------------------------------------
 
-        for serial_id, raw_orcid in nonempty_orcids:
-            cleaned_orcid = utils.trim_orcid(raw_orcid)
-            if cleaned_orcid != raw_orcid:
-                query = f"update {table_name} set orcid='{cleaned_orcid}' where serial_id='{serial_id}'"
+def split_table_name(table_name):
+    schema, name = table_name.split('.')
+    return schema, name
+
+
+def create_shadow_table(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                        shadow_table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME):
+    # Any shadow table left behind by a failed rebuild is dropped. The shadow table gets its own serial_id
+    #  sequence, so the rebuild numbers its rows from 1 without touching the live table's sequence. Its indexes
+    #  are created after it's loaded.
+    schema, shadow_name = split_table_name(shadow_table_name)
+    sequence_name = f'{schema}.{shadow_name}_serial_id_seq'
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"drop table if exists {shadow_table_name}")
+            cur.execute(f"create table {shadow_table_name} (like {table_name} including constraints)")
+            cur.execute(f"create sequence {sequence_name} owned by {shadow_table_name}.serial_id")
+            cur.execute(f"alter table {shadow_table_name} alter column serial_id set default nextval('{sequence_name}')")
+
+
+def get_indexes(cur, table_name):
+    # Returns (index name, index definition, constraint name, constraint definition) for each of the table's
+    #  indexes, with the constraint name and definition None if the index doesn't belong to a constraint.
+    #  With an empty search_path, the definitions have fully-qualified table names.
+    cur.execute("set local search_path to ''")
+    query = "select i.relname, pg_get_indexdef(i.oid), c.conname, pg_get_constraintdef(c.oid) " \
+            "from pg_index x join pg_class i on i.oid=x.indexrelid " \
+            "left join pg_constraint c on c.conindid=x.indexrelid and c.conrelid=x.indrelid " \
+            "where x.indrelid=%s::regclass order by i.relname"
+    cur.execute(query, (table_name,))
+    indexes = cur.fetchall()
+    cur.execute("reset search_path")
+    return indexes
+
+
+def create_shadow_indexes(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                          shadow_table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME):
+    # Give the shadow table the same indexes and constraints as the live table, with '_shadow' appended to their
+    #  names until the swap
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            for index_name, index_definition, constraint_name, constraint_definition in get_indexes(cur, table_name):
+                if constraint_name:
+                    query = f"alter table {shadow_table_name} " \
+                            f"add constraint {constraint_name}_shadow {constraint_definition}"
+                else:
+                    query = index_definition.replace(f" INDEX {index_name} ON {table_name} ",
+                                                     f" INDEX {index_name}_shadow ON {shadow_table_name} ", 1)
+                    if query == index_definition:
+                        raise ValueError(f'Unexpected index definition: {index_definition}')
                 cur.execute(query)
-                conn.commit()
 
 
-def make_orcid_corrections(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    orcids = corrections.init_orcid_corrections()
-    conn = get_conn()
-    with conn.cursor() as cur:
-        for orcid_obj in orcids:
-            surname = orcid_obj.surname.replace("'", "''")
-            givenname = orcid_obj.givenname.replace("'", "''")
-            orcid = orcid_obj.orcid
-            if orcid_obj.type == 'correction':
-                query = f"update {table_name} set orcid='{orcid}', correction_codes = '0' where " \
-                        f"orcid <> '' and orcid <> '{orcid}' and givenname like '{givenname}' and surname='{surname}'"
-            elif orcid_obj.type == 'stipulation':
-                query = f"update {table_name} set orcid='{orcid}', correction_codes = '99' where " \
-                        f"orcid <> '' and givenname like '{givenname}' and surname='{surname}'"
+def swap_shadow_table(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                      shadow_table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME,
+                      staging_table_name=Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME):
+    schema, name = split_table_name(table_name)
+    _, shadow_name = split_table_name(shadow_table_name)
+    shadow_sequence_name = f'{schema}.{shadow_name}_serial_id_seq'
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            shadow_indexes = get_indexes(cur, shadow_table_name)
+            # The staging table draws its serial_ids from the live table's sequence, which is dropped with it
+            query = f"alter table {staging_table_name} " \
+                    f"alter column serial_id set default nextval('{shadow_sequence_name}')"
             cur.execute(query)
+            cur.execute(f"drop table {table_name}")
+            # The rebuilt table has had no ORCIDs propagated, and its serial_ids start over
+            cur.execute("truncate eml_files.propagated_orcids")
+            cur.execute(f"alter table {shadow_table_name} rename to {name}")
+            cur.execute(f"alter sequence {shadow_sequence_name} rename to {name}_serial_id_seq")
+            for index_name, _, constraint_name, _ in shadow_indexes:
+                if constraint_name:
+                    query = f"alter table {table_name} " \
+                            f"rename constraint {constraint_name} to {constraint_name.removesuffix('_shadow')}"
+                else:
+                    query = f"alter index {schema}.{index_name} rename to {index_name.removesuffix('_shadow')}"
+                cur.execute(query)
 
 
-def apply_overrides(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    override_corrections = corrections.init_override_corrections()
+def count_rows(table_name):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = f"select count(*) from {table_name}"
+            cur.execute(query)
+            count = cur.fetchone()[0]
+    return count
 
-    conn = get_conn()
-    with conn.cursor() as cur:
-        for override_correction in override_corrections:
-            original_surname = override_correction.original_surname.replace("'", "''")
-            surname = override_correction.surname.replace("'", "''")
-
-            original_givenname = override_correction.original_givenname.replace("'", "''")
-            givenname = override_correction.givenname.replace("'", "''")
-
-            if '%' not in override_correction.original_surname:
-                surname_condition = f"surname='{original_surname}'"
-            else:
-                surname_condition = f"surname like '{original_surname}'"
-            query = f"update {table_name} " \
-                    f"set surname='{surname}', givenname='{givenname}' " \
-                    f"where {surname_condition} and " \
-                    f" givenname='{original_givenname}' and scope='{override_correction.scope}'"
+
+def get_cleaning_fingerprint():
+    # The fingerprint of the corrections the cleaned table was built with, or None if it needs to be rebuilt
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = "select fingerprint from eml_files.cleaning_state"
+            cur.execute(query)
+            fingerprint = cur.fetchone()[0]
+    return fingerprint
+
+
+def set_cleaning_fingerprint(fingerprint):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = "update eml_files.cleaning_state set fingerprint=%s"
+            cur.execute(query, (fingerprint,))
+
+
+# The rows are sent as bound parameters, this many per statement, so the number of round trips is the number of
+#  pages rather than the number of rows
+UPDATE_PAGE_SIZE = 1000
+
+
+def propagate_orcids(rows, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+    # Each row is (serial_id, orcid, correction code). Only rows with no ORCID of their own are filled in. They're
+    #  recorded in eml_files.propagated_orcids, so clear_propagated_orcids can return them to their cleaned values.
+    query = f"with propagated as (update {table_name} as t set orcid=v.orcid, correction_codes=v.correction_codes " \
+            f"from (values %s) as v(serial_id, orcid, correction_codes) " \
+            f"where t.serial_id=v.serial_id and t.orcid='' returning t.serial_id) " \
+            f"insert into eml_files.propagated_orcids (serial_id) select serial_id from propagated " \
+            f"on conflict do nothing"
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, query, rows, page_size=UPDATE_PAGE_SIZE)
+
+
+def clear_propagated_orcids(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+    # The ORCID corrections apply only to rows with an ORCID, so a row that had its ORCID filled in by propagation
+    #  had no ORCID and no correction code when it was cleaned
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = f"update {table_name} as t set orcid='', correction_codes=null " \
+                    f"from eml_files.propagated_orcids p where t.serial_id=p.serial_id"
             cur.execute(query)
+            cur.execute("truncate eml_files.propagated_orcids")
 
 
-def special_cases(s):
-    s = s.replace("¡", "")
-    s = s.replace("!", "")
-    s = s.replace("•", "-")
-    s = s.replace("/", "-")
-    s = s.replace('a€"', "-")
-    s = s.replace('a€¢', "-")
-    s = s.replace("­", "-")
-    s = s.replace("–", "-")
-    s = s.replace('+', '')
-    s = s.replace('?', '')
-    s = s.replace('>', '')
-    s = s.replace('‐', '-')
-    return s
+# ------------------------------------------------------------------------------------------------
 
 
-def normalize_name_field(field_name, table_name):
-    conn = get_conn()
-    with conn.cursor() as cur:
-        query = f"update {table_name} set {field_name}=unaccent({field_name}) where {field_name} != unaccent({field_name})"
-        cur.execute(query)
+def make_orcid_corrections(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+    # The corrections are applied in order, corrections before stipulations, so where several match a row, the last
+    #  one wins. A correction is marked with correction code 0 only if it changed the ORCID. A stipulation is always
+    #  marked with 99.
+    orcids = corrections.init_orcid_corrections()
+    rows = [(seq, orcid_obj.type, orcid_obj.surname, orcid_obj.givenname, orcid_obj.orcid)
+            for seq, orcid_obj in enumerate(orcids)]
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = "create temp table orcid_corrections " \
+                    "(seq int, type varchar, surname varchar, givenname varchar, orcid varchar) on commit drop"
+            cur.execute(query)
+            copy_rows(cur, 'orcid_corrections', ('seq', 'type', 'surname', 'givenname', 'orcid'), rows)
+            query = f"update {table_name} as t set orcid=m.orcid, correction_codes=m.correction_codes from (" \
+                    f"select t.serial_id, (array_agg(c.orcid order by c.seq desc))[1] as orcid, " \
+                    f"case when bool_or(c.type='stipulation') then '99' else '0' end as correction_codes, " \
+                    f"bool_or(c.type='stipulation' or c.orcid <> t.orcid) as changed " \
+                    f"from {table_name} t join orcid_corrections c " \
+                    f"on t.surname=c.surname and t.givenname like c.givenname " \
+                    f"where t.orcid <> '' group by t.serial_id) as m " \
+                    f"where t.serial_id=m.serial_id and m.changed"
+            cur.execute(query)
 
 
-def normalize_data_field(field_name, table_name):
-    conn = get_conn()
-    with conn.cursor() as cur:
-        subquery = '[^0-9a-zA-Z \*\-\,\/\(\)\|@\.;"&:''\#]'
-        query = f"select serial_id, {field_name} from {table_name} where {field_name} ~* '{subquery}' order by serial_id;"
-        cur.execute(query)
-        problem_cases = cur.fetchall()
-        for serial_id, problem_case in problem_cases:
-            problem_case = nlp.normalize(problem_case).replace("'", "''")  # Need to normalize before replace so quote char is normalized
-            problem_case = special_cases(problem_case)
-            query = f"update {table_name} set {field_name}='{problem_case}' where serial_id={serial_id}"
+def apply_overrides(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+    # The overrides are applied in order, and an override can apply to a name produced by an earlier one. So, in
+    #  each round, each row gets the first override that matches it and that comes after the last one it got. Rounds
+    #  continue until no more overrides apply. Typically, that's one round.
+    override_corrections = corrections.init_override_corrections()
+    rows = [(seq, override.original_surname, '%' in override.original_surname, override.original_givenname,
+             override.scope, override.surname, override.givenname)
+            for seq, override in enumerate(override_corrections, 1)]
+    with get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            query = "create temp table overrides (seq int, original_surname varchar, is_pattern boolean, " \
+                    "original_givenname varchar, scope varchar, surname varchar, givenname varchar) on commit drop"
+            cur.execute(query)
+            copy_rows(cur, 'overrides', ('seq', 'original_surname', 'is_pattern', 'original_givenname', 'scope',
+                                         'surname', 'givenname'), rows)
+            query = "create temp table applied_overrides (serial_id int primary key, seq int) on commit drop"
             cur.execute(query)
+            query = f"with next_overrides as (" \
+                    f"select distinct on (t.serial_id) t.serial_id, o.seq, o.surname, o.givenname " \
+                    f"from {table_name} t join overrides o on t.givenname=o.original_givenname and t.scope=o.scope " \
+                    f"and (t.surname=o.original_surname or (o.is_pattern and t.surname like o.original_surname)) " \
+                    f"left join applied_overrides a on a.serial_id=t.serial_id " \
+                    f"where o.seq > coalesce(a.seq, 0) order by t.serial_id, o.seq), " \
+                    f"updated as (" \
+                    f"update {table_name} t set surname=n.surname, givenname=n.givenname from next_overrides n " \
+                    f"where t.serial_id=n.serial_id returning t.serial_id, n.seq) " \
+                    f"insert into applied_overrides (serial_id, seq) (select serial_id, seq from updated) " \
+                    f"on conflict (serial_id) do update set seq=excluded.seq"
+            while True:
+                cur.execute(query)
+                if cur.rowcount == 0:
+                    break
 
 
-def normalize_db_text(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
-    # for field in ['surname', 'givenname']:
-    #     normalize_name_field(field, table_name)
-    for field in ['position', 'address', 'organization']:
-        normalize_data_field(field, table_name)
+def normalize_name_field(field_name, table_name):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            query = f"update {table_name} set {field_name}=unaccent({field_name}) where {field_name} != unaccent({field_name})"
+            cur.execute(query)
 
 
 '''
@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: eml_extractor
+
+:Synopsis:
+    Extract what we need from EML files, e.g., their responsible parties and the text that's harvested from them,
+    in a single streaming pass per file with lxml's iterparse, without building a metapype model of the whole
+    document.
+
+    What's extracted from a file is made up of facets, each made by one of the extractors in EXTRACTORS. An
+    extractor registers the elements it's interested in, either by their path below the root element, e.g.,
+    (dataset, creator), or by their name wherever they occur, e.g., keyword, each with a handler that's called with
+    the element as soon as it's been parsed. The extractor's finish function then makes the facet from what its
+    handlers returned. However many facets are asked for, each file is parsed just once.
+
+    Each facet is the same as what the corresponding function in parse_eml gets from the metapype model, e.g., the
+    responsible_parties facet is the same as parse_eml.get_all_responsible_parties: a list of
+    (pid, rp_type, [(tag, value), ...]), with the creators first, then the contacts, associated parties, metadata
+    providers, project personnel, and related project personnel, each in document order. Element content is taken
+    as metapype takes it, i.e., with leading and trailing whitespace stripped, unless it consists only of spaces,
+    tabs, and non-breaking spaces.
+
+    Each element is discarded as soon as it has been parsed, unless it's within an element an extractor is
+    interested in, so the large sections of an EML document, e.g., its dataTables and attributeLists, never
+    accumulate in memory.
+
+    extract_all spreads the files over Config.PARSE_WORKERS processes, in chunks of Config.PARSE_CHUNK_SIZE files,
+    and returns the results in the order of the files, so the caller can write them out as they arrive. The facets
+    of files that haven't changed since they were last parsed are served from the parse cache, and a file is
+    parsed only for the facets that aren't.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from collections import namedtuple
+import concurrent.futures
+import itertools
+import os
+import re
+
+from lxml import etree
+
+from metapype.eml import names
+
+from webapp.config import Config
+import webapp.creators.parse_cache as parse_cache
+
+
+# An extractor's version is bumped whenever a change to it changes what it extracts, so cached facets aren't used.
+#  paths is {path: handler} and descendants is {element name: handler}. finish is called with the pid and
+#  {path or element name: [what the handler returned for each element, in document order]}, and returns the facet,
+#  which is never None.
+Extractor = namedtuple('Extractor', 'name version paths descendants finish')
+
+EXTRACTORS = {}
+
+# Content consisting entirely of these is kept as it is, as metapype does
+BLANK_CONTENT = re.compile('^[ \xA0\x09]+$')
+
+
+def register(name, version, finish, paths=None, descendants=None):
+    EXTRACTORS[name] = Extractor(name, version, paths or {}, descendants or {}, finish)
+
+
+def local_name(tag):
+    return tag[tag.find('}') + 1:]
+
+
+def get_content(element):
+    text = element.text
+    if text is None or BLANK_CONTENT.search(text):
+        return text
+    return text.strip() or None
+
+
+def get_child_elements(element, child_name):
+    # Comments and processing instructions are not elements
+    return [child for child in element if isinstance(child.tag, str) and local_name(child.tag) == child_name]
+
+
+def get_child_element(element, child_name):
+    children = get_child_elements(element, child_name)
+    return children[0] if children else None
+
+
+def get_children(element, child_name):
+    children = []
+    for child in get_child_elements(element, child_name):
+        content = get_content(child)
+        if content:
+            children.append((child_name, content))
+    return children
+
+
+def get_first(matches, key, default):
+    results = matches.get(key)
+    return results[0] if results else default
+
+
+def get_all(matches, key):
+    return matches.get(key, [])
+
+
+def discard(element):
+    element.clear(keep_tail=True)
+    # Also discard the element's earlier siblings, which were cleared in turn, but are still in the tree
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def extract(pid, filepath, extractor_names):
+    # Returns {extractor name: facet}, or None if the file can't be parsed, in which case it's skipped, as it is with
+    #  metapype
+    extractors = [EXTRACTORS[name] for name in extractor_names]
+    path_handlers = {}
+    descendant_handlers = {}
+    for extractor in extractors:
+        for path, handler in extractor.paths.items():
+            path_handlers.setdefault(path, []).append((extractor.name, path, handler))
+        for element_name, handler in extractor.descendants.items():
+            descendant_handlers.setdefault(element_name, []).append((extractor.name, element_name, handler))
+    matches = {extractor.name: {} for extractor in extractors}
+    path = []
+    open_elements = 0
+    try:
+        for event, element in etree.iterparse(filepath, events=('start', 'end')):
+            if event == 'start':
+                path.append(local_name(element.tag))
+                if tuple(path[1:]) in path_handlers or (len(path) > 1 and path[-1] in descendant_handlers):
+                    open_elements += 1
+                continue
+            handlers = path_handlers.get(tuple(path[1:]), [])
+            if len(path) > 1 and path[-1] in descendant_handlers:
+                handlers = handlers + descendant_handlers[path[-1]]
+            for name, key, handler in handlers:
+                matches[name].setdefault(key, []).append(handler(element))
+            if handlers:
+                open_elements -= 1
+            path.pop()
+            if not open_elements:
+                discard(element)
+    except (etree.XMLSyntaxError, OSError) as err:
+        print(f'Failed to parse file {filepath}. Error:{err}')
+        return None
+    return {extractor.name: extractor.finish(pid, matches[extractor.name]) for extractor in extractors}
+
+
+def extract_chunk(filenames, extractor_names):
+    results = []
+    for filename in filenames:
+        pid = os.path.splitext(filename)[0]
+        results.append((pid, extract(pid, f'{Config.EML_FILES_PATH}/{filename}', extractor_names)))
+    return results
+
+
+def get_parse_workers():
+    return max(Config.PARSE_WORKERS or os.cpu_count() or 1, 1)
+
+
+def lookup(conn, filepath, versions):
+    # Returns (the facets found, key), or (None, None) if the file doesn't exist
+    try:
+        return parse_cache.lookup(conn, filepath, versions)
+    except FileNotFoundError:
+        print(f'File {filepath} not found')
+        return None, None
+
+
+def extract_all(filenames, extractor_names):
+    # Yields (pid, {extractor name: facet}) for each of the files, in order, with None in place of the facets of a
+    #  file that doesn't exist or can't be parsed. The files are looked up in the parse cache a window at a time, and
+    #  the ones with facets not found there are parsed for those facets, in chunks, by the process pool.
+    versions = {name: EXTRACTORS[name].version for name in extractor_names}
+    chunk_size = Config.PARSE_CHUNK_SIZE
+    workers = get_parse_workers()
+    window_size = chunk_size * workers * 4
+    executor = None
+    with parse_cache.get_conn() as conn:
+        try:
+            for start in range(0, len(filenames), window_size):
+                window = filenames[start:start + window_size]
+                filepaths = [f'{Config.EML_FILES_PATH}/{filename}' for filename in window]
+                lookups = [lookup(conn, filepath, versions) for filepath in filepaths]
+                # Files that are missing the same facets are parsed together
+                missing_by_names = {}
+                for filename, (found, _) in zip(window, lookups):
+                    if found is not None and len(found) < len(versions):
+                        missing_names = tuple(name for name in versions if name not in found)
+                        missing_by_names.setdefault(missing_names, []).append(filename)
+                parsed_by_names = {}
+                for missing_names, missing in missing_by_names.items():
+                    chunks = [missing[index:index + chunk_size] for index in range(0, len(missing), chunk_size)]
+                    if workers > 1 and len(chunks) > 1:
+                        if executor is None:
+                            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+                        parsed = executor.map(extract_chunk, chunks, itertools.repeat(missing_names))
+                    else:
+                        parsed = map(extract_chunk, chunks, itertools.repeat(missing_names))
+                    parsed_by_names[missing_names] = itertools.chain.from_iterable(parsed)
+                for filename, filepath, (found, key) in zip(window, filepaths, lookups):
+                    pid = os.path.splitext(filename)[0]
+                    if found is None:
+                        yield pid, None
+                        continue
+                    if len(found) < len(versions):
+                        missing_names = tuple(name for name in versions if name not in found)
+                        _, facets = next(parsed_by_names[missing_names])
+                        # A file that can't be parsed is cached with None for its facets, so it isn't parsed again
+                        facets = facets or dict.fromkeys(missing_names)
+                        for name in missing_names:
+                            parse_cache.store(conn, filepath, name, versions[name], key, facets[name])
+                        found.update(facets)
+                    if any(facet is None for facet in found.values()):
+                        yield pid, None
+                    else:
+                        yield pid, found
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+# ------------------------------------------------------------------------------------------------
+# Responsible parties
+# ------------------------------------------------------------------------------------------------
+
+# The paths to the responsible parties, below the root element, in the order their parties are returned
+RESPONSIBLE_PARTY_PATHS = [
+    (names.DATASET, names.CREATOR),
+    (names.DATASET, names.CONTACT),
+    (names.DATASET, names.ASSOCIATEDPARTY),
+    (names.DATASET, names.METADATAPROVIDER),
+    (names.DATASET, names.PROJECT, names.PERSONNEL),
+    (names.DATASET, names.PROJECT, names.RELATED_PROJECT, names.PERSONNEL)
+]
+
+
+def get_responsible_party(rp_element):
+    # The same (tag, value) pairs, in the same order, as parse_eml.get_responsible_party
+    party = []
+    individual_name = get_child_element(rp_element, names.INDIVIDUALNAME)
+    if individual_name is not None:
+        party.extend(get_children(individual_name, names.SALUTATION))
+        party.extend(get_children(individual_name, names.GIVENNAME))
+        party.extend(get_children(individual_name, names.SURNAME))
+    party.extend(get_children(rp_element, names.ORGANIZATIONNAME))
+    party.extend(get_children(rp_element, names.POSITIONNAME))
+    address = get_child_element(rp_element, names.ADDRESS)
+    if address is not None:
+        party.extend(get_children(address, names.DELIVERYPOINT))
+        party.extend(get_children(address, names.CITY))
+        party.extend(get_children(address, names.ADMINISTRATIVEAREA))
+        party.extend(get_children(address, names.POSTALCODE))
+        party.extend(get_children(address, names.COUNTRY))
+    party.extend(get_children(rp_element, names.PHONE))
+    party.extend(get_children(rp_element, names.ELECTRONICMAILADDRESS))
+    party.extend(get_children(rp_element, names.ONLINEURL))
+    party.extend(get_children(rp_element, names.USERID))
+    return party
+
+
+def finish_responsible_parties(pid, matches):
+    return [(pid, path[-1], party) for path in RESPONSIBLE_PARTY_PATHS for party in get_all(matches, path)]
+
+
+register('responsible_parties', 1, finish_responsible_parties,
+         paths={path: get_responsible_party for path in RESPONSIBLE_PARTY_PATHS})
+
+
+def extract_responsible_parties(pid, filepath):
+    # Returns None if the file can't be parsed
+    facets = extract(pid, filepath, ['responsible_parties'])
+    return facets['responsible_parties'] if facets else None
+
+
+def extract_all_responsible_parties(filenames):
+    # Yields (pid, responsible parties) for each of the files, in order, with None for the responsible parties of a
+    #  file that doesn't exist or can't be parsed
+    for pid, facets in extract_all(filenames, ['responsible_parties']):
+        yield pid, facets['responsible_parties'] if facets else None
+
+
+# ------------------------------------------------------------------------------------------------
+# Text, as harvested by parse_eml.harvest_eml_text, and taxa
+# ------------------------------------------------------------------------------------------------
+
+# The same as parse_eml.parse_text_type, parse_section, and parse_para
+def parse_text_type(element):
+    content = get_content(element)
+    if content:
+        return [content]
+    section = get_child_element(element, names.SECTION)
+    if section is not None:
+        return parse_section(section)
+    para = get_child_element(element, names.PARA)
+    if para is not None:
+        return parse_para(para)
+    return []
+
+
+def parse_section(element):
+    text = []
+    content = get_content(element)
+    if content:
+        return [content]
+    title = get_child_element(element, names.TITLE)
+    if title is not None and get_content(title):
+        text.append(get_content(title))
+    section = get_child_element(element, names.SECTION)
+    if section is not None:
+        text.extend(parse_section(section))
+        return text
+    para = get_child_element(element, names.PARA)
+    if para is not None:
+        text.extend(parse_para(para))
+    return text
+
+
+def parse_para(element):
+    content = get_content(element)
+    if content:
+        return [content]
+    value = get_child_element(element, names.VALUE)
+    if value is not None and get_content(value):
+        return [get_content(value)]
+    return []
+
+
+def get_dataset_title(title_element):
+    value = get_child_element(title_element, names.VALUE)
+    if value is not None:
+        return [get_content(value)]
+    return [get_content(title_element)]
+
+
+def get_dataset_abstract(abstract_element):
+    para = get_child_element(abstract_element, names.PARA)
+    if para is None:
+        section = get_child_element(abstract_element, names.SECTION)
+        if section is not None:
+            para = get_child_element(section, names.PARA)
+    if para is not None:
+        return parse_text_type(para)
+    return []
+
+
+def get_project_text(project_element):
+    # (title, abstract), as in parse_eml.ProjectText
+    title = ''
+    abstract = ''
+    title_element = get_child_element(project_element, names.TITLE)
+    if title_element is not None:
+        title = [get_content(title_element)]
+    abstract_element = get_child_element(project_element, names.ABSTRACT)
+    if abstract_element is not None:
+        abstract = parse_text_type(abstract_element)
+    return title, abstract
+
+
+def get_projects(project_element):
+    related_projects = get_child_elements(project_element, names.RELATED_PROJECT)
+    return get_project_text(project_element), [get_project_text(related) for related in related_projects]
+
+
+def get_ranks(classification_element):
+    ranks = []
+    for rank_name in get_child_elements(classification_element, names.TAXONRANKNAME):
+        rank_value = get_child_element(classification_element, names.TAXONRANKVALUE)
+        if get_content(rank_name) and rank_value is not None and get_content(rank_value):
+            ranks.append((get_content(rank_name).lower(), get_content(rank_value)))
+    return ranks
+
+
+DATASET_TITLE_PATH = (names.DATASET, names.TITLE)
+DATASET_ABSTRACT_PATH = (names.DATASET, names.ABSTRACT)
+DATATABLE_DESCRIPTION_PATH = (names.DATASET, names.DATATABLE, names.ENTITYDESCRIPTION)
+GEOGRAPHIC_DESCRIPTION_PATH = (names.DATASET, names.COVERAGE, names.GEOGRAPHICCOVERAGE, names.GEOGRAPHICDESCRIPTION)
+METHOD_STEP_DESCRIPTION_PATH = (names.DATASET, names.METHODS, names.METHODSTEP, names.DESCRIPTION)
+PROJECT_PATH = (names.DATASET, names.PROJECT)
+
+
+def finish_dataset_title(pid, matches):
+    return get_first(matches, DATASET_TITLE_PATH, [])
+
+
+def finish_dataset_abstract(pid, matches):
+    return get_first(matches, DATASET_ABSTRACT_PATH, [])
+
+
+def finish_dataset_keywords(pid, matches):
+    return get_all(matches, names.KEYWORD)
+
+
+def finish_datatable_descriptions(pid, matches):
+    return [text for texts in get_all(matches, DATATABLE_DESCRIPTION_PATH) for text in texts]
+
+
+def finish_dataset_geographic_descriptions(pid, matches):
+    return [text for text in get_all(matches, GEOGRAPHIC_DESCRIPTION_PATH) if text]
+
+
+def finish_method_step_descriptions(pid, matches):
+    return [text for texts in get_all(matches, METHOD_STEP_DESCRIPTION_PATH) for text in texts]
+
+
+def finish_projects(pid, matches):
+    # (projects, related projects), as parse_eml.harvest_projects
+    projects = get_all(matches, PROJECT_PATH)
+    return [project for project, _ in projects], [related for _, related_projects in projects
+                                                  for related in related_projects]
+
+
+def finish_taxa(pid, matches):
+    # {rank, e.g., 'genus': sorted values}, as parse_eml.get_all_ranks
+    taxa = {}
+    for ranks in get_all(matches, names.TAXONOMICCLASSIFICATION):
+        for rank, value in ranks:
+            taxa.setdefault(rank, set()).add(value)
+    return {rank: sorted(values) for rank, values in taxa.items()}
+
+
+register('dataset_title', 1, finish_dataset_title, paths={DATASET_TITLE_PATH: get_dataset_title})
+register('dataset_abstract', 1, finish_dataset_abstract, paths={DATASET_ABSTRACT_PATH: get_dataset_abstract})
+register('dataset_keywords', 1, finish_dataset_keywords, descendants={names.KEYWORD: get_content})
+register('datatable_descriptions', 1, finish_datatable_descriptions,
+         paths={DATATABLE_DESCRIPTION_PATH: parse_text_type})
+register('dataset_geographic_descriptions', 1, finish_dataset_geographic_descriptions,
+         paths={GEOGRAPHIC_DESCRIPTION_PATH: get_content})
+register('method_step_descriptions', 1, finish_method_step_descriptions,
+         paths={METHOD_STEP_DESCRIPTION_PATH: parse_text_type})
+register('projects', 1, finish_projects, paths={PROJECT_PATH: get_projects})
+register('taxa', 1, finish_taxa, descendants={names.TAXONOMICCLASSIFICATION: get_ranks})
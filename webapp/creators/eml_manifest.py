@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: eml_manifest
+
+:Synopsis:
+    A manifest of the EML files in Config.EML_FILES_PATH, kept in Config.EML_MANIFEST_PATH, so the full list of
+    files can be had without listing the directory, which holds every EML file in the repository.
+
+    The manifest records the directory's modification time as of when it was made. If the directory has changed
+    since, e.g., because files were added by download_eml.py, the manifest is made again from a listing of the
+    directory. The nightly update and repair record their own changes by way of update(), so they don't cause the
+    directory to be listed. They pass the modification time from before their changes, and if it isn't the one the
+    manifest was made with, someone else has changed the directory, too, and it's listed again. The manifest can be
+    made again by hand with:
+        python -m webapp.creators.eml_manifest
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import os
+
+from webapp.config import Config
+
+
+def get_directory_mtime():
+    return os.stat(Config.EML_FILES_PATH).st_mtime_ns
+
+
+def read_manifest():
+    # Returns (directory mtime, filenames), or (None, None) if there's no manifest
+    try:
+        with open(Config.EML_MANIFEST_PATH, 'r', encoding='utf-8') as manifest_file:
+            mtime_ns = int(manifest_file.readline())
+            return mtime_ns, [line.rstrip('\n') for line in manifest_file]
+    except (FileNotFoundError, ValueError):
+        return None, None
+
+
+def write_manifest(mtime_ns, filenames):
+    # Write to a temporary file and rename it, so a reader never sees a partial manifest
+    temp_path = f'{Config.EML_MANIFEST_PATH}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+        manifest_file.write(f'{mtime_ns}\n')
+        manifest_file.writelines(f'{filename}\n' for filename in filenames)
+    os.replace(temp_path, Config.EML_MANIFEST_PATH)
+
+
+def rebuild():
+    # Get the mtime first, so a change made while the directory is being listed shows up next time
+    mtime_ns = get_directory_mtime()
+    with os.scandir(Config.EML_FILES_PATH) as entries:
+        filenames = sorted(entry.name for entry in entries if entry.name.endswith('.xml'))
+    write_manifest(mtime_ns, filenames)
+    return filenames
+
+
+def get_eml_filenames():
+    # The names of the EML files, e.g., 'edi.1.1.xml', sorted
+    mtime_ns, filenames = read_manifest()
+    if filenames is None or mtime_ns != get_directory_mtime():
+        filenames = rebuild()
+    return filenames
+
+
+def get_package_ids():
+    return [os.path.splitext(filename)[0] for filename in get_eml_filenames()]
+
+
+def update(mtime_ns, added_package_ids=None, removed_package_ids=None):
+    # Record changes made to the directory by the caller, who has had the manifest made current, e.g., by calling
+    #  get_eml_filenames(), and then taken the directory's mtime with get_directory_mtime() before making them
+    manifest_mtime_ns, filenames = read_manifest()
+    if filenames is None or mtime_ns != manifest_mtime_ns:
+        rebuild()
+        return
+    filenames = set(filenames)
+    for package_id in removed_package_ids or []:
+        filenames.discard(f'{package_id}.xml')
+    for package_id in added_package_ids or []:
+        if os.path.exists(f'{Config.EML_FILES_PATH}/{package_id}.xml'):
+            filenames.add(f'{package_id}.xml')
+    write_manifest(get_directory_mtime(), sorted(filenames))
+
+
+if __name__ == '__main__':
+    print(f'{len(rebuild())} EML files')
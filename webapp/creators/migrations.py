@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: migrations
+
+:Synopsis:
+    Versioned schema for the eml_files tables. Each migration is applied once, in its own transaction, and
+    recorded in eml_files.schema_version. migrate() applies any migrations not yet applied. It is called at the
+    start of the pipeline, so a server picks up schema changes the next time the names are updated. It can also
+    be run by hand:
+        python -m webapp.creators.migrations
+
+    Migration 1 is the schema created by data/create_eml_schemas.sql, with guards so it can be applied to a
+    database that was created with that script. New migrations are added to the end of MIGRATIONS and must never
+    be edited once they've been deployed.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import daiquiri
+
+from webapp.config import Config
+import webapp.creators.db as db
+
+logger = daiquiri.getLogger(Config.LOG_FILE)
+
+SCHEMA_VERSION_TABLE_NAME = 'eml_files.schema_version'
+
+# Arbitrary key for the advisory lock that keeps two processes from migrating at the same time
+MIGRATIONS_LOCK_KEY = 20261019
+
+MIGRATIONS = [
+    (1, 'Baseline eml_files schema', [
+        """
+        do $$ begin
+            create type eml_files.rp_type as enum (
+                'creator',
+                'contact',
+                'associatedParty',
+                'metadataProvider',
+                'personnel');
+        exception
+            when duplicate_object then null;
+        end $$
+        """,
+        """
+        create table if not exists eml_files.responsible_parties_raw (
+            pid varchar(50) not null,
+            rp_type eml_files.rp_type not null,
+            givenname varchar(100),
+            surname varchar(100),
+            organization varchar(1024),
+            position varchar(256),
+            address varchar(256),
+            city varchar(256),
+            country varchar(100),
+            email varchar(256),
+            url varchar(256),
+            orcid varchar(256),
+            scope varchar(100) not null,
+            identifier int8 not null
+        )
+        """,
+        """
+        create table if not exists eml_files.responsible_parties (
+            serial_id serial primary key,
+            pid varchar not null,
+            rp_type eml_files.rp_type not null,
+            givenname varchar,
+            surname varchar,
+            organization varchar,
+            position varchar,
+            address varchar,
+            city varchar,
+            country varchar,
+            email varchar,
+            url varchar,
+            orcid varchar,
+            scope varchar not null,
+            identifier int8 not null,
+            correction_codes varchar,
+            organization_keywords varchar,
+            skip boolean
+        )
+        """
+    ]),
+    (2, 'Indexes for the pid, scope, name, and orcid lookups', [
+        "create index if not exists responsible_parties_pid_idx on eml_files.responsible_parties (pid)",
+        "create index if not exists responsible_parties_scope_rp_type_idx "
+        "on eml_files.responsible_parties (scope, rp_type)",
+        "create index if not exists responsible_parties_name_idx on eml_files.responsible_parties (surname, givenname)",
+        "create index if not exists responsible_parties_orcid_idx on eml_files.responsible_parties (orcid) "
+        "where orcid <> ''",
+        "create index if not exists responsible_parties_raw_pid_idx "
+        "on eml_files.responsible_parties_raw (pid, rp_type, surname, givenname)",
+        "analyze eml_files.responsible_parties",
+        "analyze eml_files.responsible_parties_raw"
+    ]),
+    (3, 'Unique key on the raw table, replacing the post-load dedupe', [
+        "delete from eml_files.responsible_parties_raw T1 using eml_files.responsible_parties_raw T2 "
+        "where T1.ctid < T2.ctid and T1.givenname = T2.givenname and T1.surname = T2.surname and "
+        "T1.pid = T2.pid and T1.rp_type = T2.rp_type",
+        "create unique index if not exists responsible_parties_raw_key_idx "
+        "on eml_files.responsible_parties_raw (pid, rp_type, surname, givenname)",
+        "drop index if exists eml_files.responsible_parties_raw_pid_idx"
+    ]),
+    (4, 'Staging table and state for incremental updates of the cleaned table', [
+        # Including defaults means the staging table draws its serial_ids from the same sequence
+        "create table if not exists eml_files.responsible_parties_staging "
+        "(like eml_files.responsible_parties including defaults)",
+        "create table if not exists eml_files.cleaning_state (fingerprint varchar)",
+        "insert into eml_files.cleaning_state (fingerprint) values (null)"
+    ]),
+    (5, 'Record of the ORCIDs filled in by propagation, so they can be undone', [
+        "create table if not exists eml_files.propagated_orcids (serial_id int primary key)"
+    ])
+]
+
+
+def get_schema_version(cur):
+    query = f"select coalesce(max(version), 0) from {SCHEMA_VERSION_TABLE_NAME}"
+    cur.execute(query)
+    return cur.fetchone()[0]
+
+
+def migrate():
+    with db.get_conn(autocommit=False) as conn:
+        with conn.cursor() as cur:
+            cur.execute("create schema if not exists eml_files")
+            query = f"create table if not exists {SCHEMA_VERSION_TABLE_NAME} (" \
+                    f"version int primary key, description varchar, applied timestamp default now())"
+            cur.execute(query)
+    for version, description, statements in MIGRATIONS:
+        with db.get_conn(autocommit=False) as conn:
+            with conn.cursor() as cur:
+                cur.execute("select pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+                if get_schema_version(cur) >= version:
+                    continue
+                logger.info(f'Applying migration {version}: {description}')
+                for statement in statements:
+                    cur.execute(statement)
+                query = f"insert into {SCHEMA_VERSION_TABLE_NAME} (version, description) values (%s, %s)"
+                cur.execute(query, (version, description))
+
+
+if __name__ == '__main__':
+    migrate()
@@ -13,11 +13,42 @@
     7/7/21
 """
 
-import textacy.preprocessing as tprep
+import functools
+import re
+
 from unidecode import unidecode
 
 
+# normalize is called with the same few thousand names over and over, so its results are memoized, up to this many
+NORMALIZE_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=None)
+def get_tprep():
+    # textacy brings spaCy and friends with it, which take over a second to import, so it's imported on first use,
+    #  i.e., by the update pipeline, rather than by every worker that imports this module
+    import textacy.preprocessing as tprep
+    import textacy.preprocessing.resources
+    return tprep
+
+
+@functools.lru_cache(maxsize=None)
+def get_ascii_quotes():
+    # Of the ASCII characters, only the backtick is changed by tprep.normalize.quotation_marks
+    quote_translation_table = get_tprep().resources.QUOTE_TRANSLATION_TABLE
+    return str.maketrans({char: quote_translation_table[ord(char)]
+                          for char in map(chr, range(128)) if ord(char) in quote_translation_table})
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize(text):
+    if text.isascii():
+        # The unicode normalization and unidecode leave ASCII text as it is, so just the hyphenated words and quotes
+        #  need to be normalized
+        if '-' in text:
+            text = get_tprep().resources.RE_HYPHENATED_WORD.sub(r"\1\2", text)
+        return text.translate(get_ascii_quotes())
+    tprep = get_tprep()
     text = tprep.normalize.hyphenated_words(text)
     text = tprep.normalize.quotation_marks(text)
     text = tprep.normalize.unicode(text)
@@ -26,5 +57,22 @@ def normalize(text):
     return text
 
 
+def normalize_all(texts):
+    # Normalize a column of strings, normalizing each distinct string once
+    normalized = {text: normalize(text) for text in dict.fromkeys(texts)}
+    return [normalized[text] for text in texts]
+
+
+def clean(text, remove_digits=False):
+    # Normalized, lowercase text, without punctuation (and digits, optionally), for use in text analysis
+    text = normalize(text)
+    tprep = get_tprep()
+    text = tprep.remove.punctuation(text)
+    if remove_digits:
+        text = re.sub(r'\d+', ' ', text)
+    text = tprep.normalize.whitespace(text)
+    return text.lower()
+
+
 if __name__ == '__main__':
     pass
\ No newline at end of file
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: organizations
+
+:Synopsis:
+    Tag responsible parties with the keywords of the organizations they belong to, per organizations.xml.
+
+    A responsible party belongs to an organization if its organization or address contains one of the
+    organization's names, or if its email or url is in one of the organization's email domains. I.e., the
+    tests, in SQL LIKE terms, are:
+        organization like '%<name>%'
+        address like '%<name>%'
+        email like '%@<email>%'
+        email like '%.<email>%'
+        url like '%/<email>'
+        url like '%.<email>'
+    Names may contain % wildcards, e.g., 'U%of California%Berkeley'.
+
+    Rather than test each organization in turn, the literal pieces of all of the patterns are compiled into a
+    single Aho-Corasick automaton, which finds all of them in a text in one pass. Only the patterns whose pieces
+    were found need to be checked further. So, tagging takes time linear in the size of the text, more or less
+    independent of the number of organizations.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import bisect
+from collections import deque
+
+import webapp.creators.corrections as corrections
+
+
+class AhoCorasick:
+    def __init__(self, keys):
+        # State 0 is the root. For each state: transitions, failure link, and ids of the keys that end there.
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._lengths = [len(key) for key in keys]
+        for key_id, key in enumerate(keys):
+            state = 0
+            for c in key:
+                next_state = self._goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][c] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(key_id)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(c, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        # Returns {key_id: [start, ...]}, with the starts of all occurrences, overlapping or not, in increasing order
+        found = {}
+        state = 0
+        for index, c in enumerate(text):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for key_id in self._output[state]:
+                found.setdefault(key_id, []).append(index + 1 - self._lengths[key_id])
+        return found
+
+
+class Pattern:
+    # A LIKE pattern, '%<segment>%<segment>...%', optionally anchored at the end of the text. Segments are ids of
+    #  keys in the automaton.
+    def __init__(self, organization_index, segments, segment_lengths, anchored_at_end=False):
+        self.organization_index = organization_index
+        self.segments = segments
+        self.segment_lengths = segment_lengths
+        self.anchored_at_end = anchored_at_end
+
+    def matches(self, found, text_length):
+        # Match the segments in order, each at its earliest occurrence after the end of the previous one
+        position = 0
+        last = len(self.segments) - 1
+        for i, (segment, length) in enumerate(zip(self.segments, self.segment_lengths)):
+            starts = found.get(segment)
+            if not starts:
+                return False
+            if i == last and self.anchored_at_end:
+                return starts[-1] >= position and starts[-1] + length == text_length
+            j = bisect.bisect_left(starts, position)
+            if j == len(starts):
+                return False
+            position = starts[j] + length
+        return True
+
+
+class OrganizationTagger:
+    FIELDS = ('organization', 'address', 'email', 'url')
+
+    def __init__(self, organizations):
+        self._keywords = [organization.keyword for organization in organizations]
+        self._keys = []
+        key_ids = {}
+        # Patterns, by field, and, for each field, the patterns that use each key
+        self._patterns = {field: [] for field in OrganizationTagger.FIELDS}
+        self._patterns_by_key = {field: {} for field in OrganizationTagger.FIELDS}
+        # Patterns with no literal segments, which match any text
+        self._match_all = {field: set() for field in OrganizationTagger.FIELDS}
+
+        def add_pattern(field, organization_index, like_pattern, anchored_at_end=False):
+            segments = [segment for segment in like_pattern.split('%') if segment]
+            if not segments:
+                self._match_all[field].add(organization_index)
+                return
+            if anchored_at_end and like_pattern.endswith('%'):
+                anchored_at_end = False
+            segment_ids = []
+            for segment in segments:
+                if segment not in key_ids:
+                    key_ids[segment] = len(self._keys)
+                    self._keys.append(segment)
+                segment_ids.append(key_ids[segment])
+            pattern = Pattern(organization_index, segment_ids, [len(segment) for segment in segments],
+                              anchored_at_end)
+            self._patterns[field].append(pattern)
+            for segment_id in set(segment_ids):
+                self._patterns_by_key[field].setdefault(segment_id, []).append(pattern)
+
+        for organization_index, organization in enumerate(organizations):
+            for name in organization.names:
+                add_pattern('organization', organization_index, name)
+                add_pattern('address', organization_index, name)
+            for email in organization.emails:
+                add_pattern('email', organization_index, f'@{email}')
+                add_pattern('email', organization_index, f'.{email}')
+                add_pattern('url', organization_index, f'/{email}', anchored_at_end=True)
+                add_pattern('url', organization_index, f'.{email}', anchored_at_end=True)
+
+        self._automaton = AhoCorasick(self._keys)
+
+    def matching_organizations(self, field, text):
+        matched = set(self._match_all[field])
+        if not text:
+            return matched
+        found = self._automaton.find_all(text)
+        patterns_by_key = self._patterns_by_key[field]
+        for key_id in found:
+            for pattern in patterns_by_key.get(key_id, []):
+                if pattern.organization_index not in matched and pattern.matches(found, len(text)):
+                    matched.add(pattern.organization_index)
+        return matched
+
+    def get_keywords(self, organization, address, email, url):
+        # Returns the keywords, in the order of the organizations file, each preceded by a space, as they were when
+        #  concatenated in the database. Returns None if there are none.
+        matched = set()
+        for field, text in zip(OrganizationTagger.FIELDS, (organization, address, email, url)):
+            matched |= self.matching_organizations(field, text)
+        if not matched:
+            return None
+        return ''.join(f' {self._keywords[index]}' for index in sorted(matched))
+
+
+def init_organization_tagger():
+    return OrganizationTagger(corrections.init_organizations())
+
+
+if __name__ == '__main__':
+    tagger = init_organization_tagger()
+    print(tagger.get_keywords('University of California, Berkeley', '', 'someone@asu.edu', 'http://www.unm.edu'))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: parse_cache
+
+:Synopsis:
+    A persistent cache of what's been extracted from each EML file, so unchanged files aren't parsed again, e.g., by
+    a full rebuild after a change to the code or the corrections. It's kept in a SQLite database in
+    Config.PARSE_CACHE_PATH (None turns it off).
+
+    An entry is keyed by the file's name and the kind of extraction, e.g., 'responsible_parties', and records the
+    file's size, modification time, and content hash, and the version of the extractor. A file whose size and
+    modification time match its entry is taken to be unchanged without reading it. Otherwise, it's unchanged if
+    its content hash matches. An entry made by another version of the extractor is ignored, so an extractor's
+    version is bumped whenever a change to it changes what it extracts. The cache can be cleared by hand with:
+        python -m webapp.creators.parse_cache clear
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from contextlib import contextmanager
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+
+from webapp.config import Config
+
+
+@contextmanager
+def get_conn():
+    # Yields None if the cache is turned off
+    if not Config.PARSE_CACHE_PATH:
+        yield None
+        return
+    conn = sqlite3.connect(Config.PARSE_CACHE_PATH, timeout=Config.SQLITE_TIMEOUT, isolation_level=None)
+    try:
+        conn.execute("pragma journal_mode=wal")
+        # Entries are written one at a time, and a lost entry is just parsed again
+        conn.execute("pragma synchronous=normal")
+        conn.execute("create table if not exists parse_cache (filename text, kind text, size integer, "
+                     "mtime_ns integer, sha256 text, version integer, value blob, primary key (filename, kind))")
+        yield conn
+    finally:
+        conn.close()
+
+
+def get_sha256(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def lookup(conn, filepath, versions):
+    # versions is {kind: version}. Returns ({kind: value} for the kinds found, key), where key identifies the file's
+    #  current content, for use with store().
+    stat = os.stat(filepath)
+    key = [stat.st_size, stat.st_mtime_ns, None]
+    if conn is None:
+        return {}, key
+    filename = os.path.basename(filepath)
+    query = f"select kind, size, mtime_ns, sha256, version, value from parse_cache " \
+            f"where filename=? and kind in ({', '.join('?' for _ in versions)})"
+    entries = [entry for entry in conn.execute(query, (filename, *versions)) if entry[4] == versions[entry[0]]]
+    found = {}
+    for kind, size, mtime_ns, sha256, _, value in entries:
+        if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+            found[kind] = pickle.loads(value)
+    if len(found) == len(entries):
+        return found, key
+    key[2] = get_sha256(filepath)
+    for kind, size, mtime_ns, sha256, _, value in entries:
+        if kind not in found and size == stat.st_size and sha256 == key[2]:
+            # E.g., the file was downloaded again
+            conn.execute("update parse_cache set mtime_ns=? where filename=? and kind=?",
+                         (stat.st_mtime_ns, filename, kind))
+            found[kind] = pickle.loads(value)
+    return found, key
+
+
+def store(conn, filepath, kind, version, key, value):
+    if conn is None:
+        return
+    size, mtime_ns, sha256 = key
+    query = "insert or replace into parse_cache (filename, kind, size, mtime_ns, sha256, version, value) " \
+            "values (?, ?, ?, ?, ?, ?, ?)"
+    conn.execute(query, (os.path.basename(filepath), kind, size, mtime_ns, sha256 or get_sha256(filepath), version,
+                         pickle.dumps(value)))
+
+
+def prune(conn, filenames):
+    # Remove the entries for files other than these, e.g., older revisions that have been deleted
+    if conn is None:
+        return
+    conn.execute("create temp table current_files (filename text primary key)")
+    conn.executemany("insert or ignore into current_files values (?)", ((filename,) for filename in filenames))
+    conn.execute("delete from parse_cache where filename not in (select filename from current_files)")
+    conn.execute("drop table current_files")
+
+
+def clear(kind=None):
+    with get_conn() as conn:
+        if conn is None:
+            return
+        if kind:
+            conn.execute("delete from parse_cache where kind=?", (kind,))
+        else:
+            conn.execute("delete from parse_cache")
+        conn.execute("vacuum")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['clear']:
+        clear(*sys.argv[2:3])
@@ -4,7 +4,7 @@
 """
 :Mod: propagate_names
 
-:Synopsis: Parse EML files to collect information on the responsible parties, creating RESPONSIBLE_PARTIES_TEXT_FILE.
+:Synopsis: Parse EML files to collect information on the responsible parties, adding them to RESPONSIBLE_PARTIES_RECORDS_FILE.
 
 :Author:
     ide
@@ -14,16 +14,20 @@
 """
 from collections import namedtuple
 from enum import Enum, auto
-import glob
 import os
-import pickle
 
 import daiquiri
 from flask import Flask, current_app
 
 from webapp.config import Config
-import webapp.creators.db as db
+import webapp.creators.eml_extractor as eml_extractor
+import webapp.creators.eml_manifest as eml_manifest
 import webapp.creators.nlp as nlp
+import webapp.creators.parse_cache as parse_cache
+import webapp.creators.record_store as record_store
+import webapp.creators.search_index as search_index
+import webapp.creators.storage as storage
+import webapp.creators.text_store as text_store
 
 from metapype.eml import names
 from metapype.model.metapype_io import from_xml
@@ -68,7 +72,22 @@ EMLText = namedtuple(
     'dataset_title dataset_abstract dataset_keywords datatable_descriptions dataset_geographic_descriptions method_step_descriptions projects related_projects'
 )
 
-eml_text_by_pid = {}
+TEXT_FIELDS_BY_COMPONENT = {
+    EMLTextComponents.DATASET_TITLE: 'dataset_title',
+    EMLTextComponents.DATASET_ABSTRACT: 'dataset_abstract',
+    EMLTextComponents.DATASET_KEYWORDS: 'dataset_keywords',
+    EMLTextComponents.DATATABLE_DESCRIPTIONS: 'datatable_descriptions',
+    EMLTextComponents.DATASET_GEO_DESCRIPTIONS: 'dataset_geographic_descriptions',
+    EMLTextComponents.METHOD_STEP_DESCRIPTIONS: 'method_step_descriptions'
+}
+PROJECT_COMPONENTS = (EMLTextComponents.PROJECT_TITLES,
+                      EMLTextComponents.PROJECT_ABSTRACTS,
+                      EMLTextComponents.RELATED_PROJECT_TITLES,
+                      EMLTextComponents.RELATED_PROJECT_ABSTRACTS)
+
+# The eml_extractor facets that make up EMLText
+TEXT_FACETS = ('dataset_title', 'dataset_abstract', 'dataset_keywords', 'datatable_descriptions',
+               'dataset_geographic_descriptions', 'method_step_descriptions', 'projects')
 
 
 def xml_to_json(filepath):
@@ -127,14 +146,15 @@ def parse_text_type(node):
 
 
 def get_existing_eml_files():
-    filelist = glob.glob(f'{Config.EML_FILES_PATH}/*.xml')
-    return [os.path.basename(x) for x in filelist]
+    return eml_manifest.get_eml_filenames()
 
 
 def get_dataset_title(eml_node):
     title_node = eml_node.find_single_node_by_path([names.DATASET, names.TITLE, names.VALUE])
     if not title_node:
         title_node = eml_node.find_single_node_by_path([names.DATASET, names.TITLE])
+    if not title_node:
+        return []
     return [title_node.content]
 
 
@@ -363,185 +383,190 @@ def parse_eml_file(filename):
     return pid, eml_node
 
 
+def harvest(filelist, sinks):
+    # Parse each of the files once, for all of the facets the sinks need, and pass each sink the facets of each
+    #  file, in order. sinks is a list of (facet names, function(pid, {facet name: facet})). Files that don't exist or
+    #  can't be parsed are skipped. See eml_extractor for the facets.
+    facet_names = list(dict.fromkeys(name for names, _ in sinks for name in names))
+    for pid, facets in eml_extractor.extract_all(filelist, facet_names):
+        if facets is None:
+            continue
+        for _, sink in sinks:
+            sink(pid, facets)
+
+
 def collect_responsible_parties(filename, added_package_ids=None, removed_package_ids=None, trace=False):
     if added_package_ids == [] and removed_package_ids == []:
         return
-    responsible_parties = db.parse_responsible_parties_file(filename)
-    db.prune_pids(responsible_parties, removed_package_ids)
-    # write the existing responsible parties, minus the ones to be removed
-    output_filename = f'{Config.EML_FILES_PATH}/{filename}'
-    with open(output_filename, 'w', encoding='utf-8') as output_file:
-        for _, val in responsible_parties.items():
-            for line in val:
-                output_file.write(line)
-                output_file.write('\n')
-    # now, append the new responsible parties
-    with open(output_filename, 'a', encoding='utf-8') as output_file:
+    if added_package_ids is not None:
+        # Delete the added pids, too, because we may have already run this today. They'll just get added back in.
+        record_store.delete_pids(filename, list(removed_package_ids or []) + list(added_package_ids))
+        # Just the files for the added pids. One whose file is missing is reported and skipped.
+        filelist = [f'{pid}.xml' for pid in dict.fromkeys(added_package_ids)]
+    else:
+        # Start over with all of the files
+        record_store.clear(filename)
         filelist = get_existing_eml_files()
-        if trace:
-            log_info(f'len(filelist)={len(filelist)}')
-        for index, filename in enumerate(filelist):
-            pid = os.path.splitext(filename)[0]
-            if added_package_ids and pid not in added_package_ids:
-                continue
-            pid, eml_node = parse_eml_file(filename)
-            if eml_node:
-                if trace:
-                    log_info(f'  Adding {index} - {pid}')
-                responsible_parties = get_all_responsible_parties(pid, eml_node)
-                for responsible_party in responsible_parties:
-                    output_file.write(str(responsible_party))
-                    output_file.write('\n')
-                    output_file.flush()
-                # We're done with the JSON model. Delete it so we don't run out of memory.
-                Node.delete_node_instance(eml_node.id, True)
+        with parse_cache.get_conn() as conn:
+            parse_cache.prune(conn, filelist)
+    if trace:
+        log_info(f'len(filelist)={len(filelist)}')
+
+    with record_store.open_appender(filename) as append:
+        def add_responsible_parties(pid, facets):
+            if trace:
+                log_info(f'  Adding {pid}')
+            append(pid, facets['responsible_parties'])
+
+        sinks = [(('responsible_parties',), add_responsible_parties)]
+        if Config.HARVEST_EML_TEXT:
+            # Harvest the files' text in the same pass
+            with text_store.get_conn() as text_conn, search_index.get_conn() as search_conn:
+                harvest(filelist, sinks + [get_eml_text_sink(text_conn, search_conn)])
+        else:
+            harvest(filelist, sinks)
+    record_store.compact_if_needed(filename)
+
+
+def get_titles_and_abstracts_text(facets):
+    # The all_text of get_all_titles_and_abstracts
+    all_text = f"{facets['dataset_title'][0]} " if facets['dataset_title'] else ''
+    if facets['dataset_abstract']:
+        all_text += ' '.join(facets['dataset_abstract'])
+    return all_text
 
 
 def collect_titles_and_abstracts(output_filename):
     with open(output_filename, 'w', encoding='utf-8') as output_file:
-        filelist = get_existing_eml_files()
-        for index, filename in enumerate(filelist):
-            # if filename.startswith('edi.'):  # TEMP
-            pid = filename[:-4]
-            filepath = f'{Config.EML_FILES_PATH}/{filename}'
-            eml_node = xml_to_json(filepath)
-            if not eml_node:
-                continue
-            dataset_title, dataset_abstract, project_titles, project_abstracts, all_text = get_all_titles_and_abstracts(eml_node)
-            all_text = all_text.replace('\n', '')
+        def write_titles_and_abstracts(pid, facets):
+            all_text = get_titles_and_abstracts_text(facets).replace('\n', '')
             output_file.write(f'{pid}\n')
             output_file.write(f'{all_text}\n')
 
+        harvest(get_existing_eml_files(), [(('dataset_title', 'dataset_abstract'), write_titles_and_abstracts)])
+
 
 def collect_method_step_descriptions(output_filename):
     with open(output_filename, 'w', encoding='utf-8') as output_file:
-        filelist = get_existing_eml_files()
-        for index, filename in enumerate(filelist):
-            # if filename.startswith('edi.'):  # TEMP
-            pid = filename[:-4]
-            filepath = f'{Config.EML_FILES_PATH}/{filename}'
-            eml_node = xml_to_json(filepath)
-            if not eml_node:
-                continue
-            text = get_data_table_descriptions(eml_node)
-            text = get_method_step_descriptions(eml_node)
+        def write_method_step_descriptions(pid, facets):
+            text = facets['datatable_descriptions']
+            text = facets['method_step_descriptions']
             # all_text = all_text.replace('\n', '')
             # output_file.write(f'{pid}\n')
             # output_file.write(f'{all_text}\n')
 
-
-def collect_text_for_scope(scope):
-    text = []
-    filelist = get_existing_eml_files()
-    for index, filename in enumerate(filelist):
-        if filename.startswith(scope):
-            filepath = f'{Config.EML_FILES_PATH}/{filename}'
-            eml_node = xml_to_json(filepath)
-            if not eml_node:
-                continue
-            text1 = get_data_table_descriptions(eml_node)
-            text2 = [] #get_method_step_descriptions(eml_node)
-            *_, text3 = get_all_titles_and_abstracts(eml_node)
-            text.append(' '.join(text1) + ' '.join(text2) + text3)
-    return ' '.join(text)
+        harvest(get_existing_eml_files(),
+                [(('datatable_descriptions', 'method_step_descriptions'), write_method_step_descriptions)])
 
 
-def collect_text(pids):
+def collect_text_for_filelist(filelist, components):
     text = []
-    for pid in pids:
-        filename = pid + '.xml'
-        filepath = f'{Config.EML_FILES_PATH}/{filename}'
-        eml_node = xml_to_json(filepath)
-        if not eml_node:
-            continue
-        text1 = [] #get_data_table_descriptions(eml_node)
-        text2 = [] #get_method_step_descriptions(eml_node)
-        *_, text3 = get_all_titles_and_abstracts(eml_node)
-        text.append(' '.join(text1) + ' '.join(text2) + text3)
-    return ' '.join(text)
 
+    def add_text(pid, facets):
+        text.append(' '.join(facets.get('datatable_descriptions', [])) +
+                    ' '.join(facets.get('method_step_descriptions', [])) +
+                    get_titles_and_abstracts_text(facets))
 
-def init_eml_text_by_pid():
-    global eml_text_by_pid
-
-    filename = 'eml_text_by_pid.pkl'
-    filepath = f'{Config.DATA_FILES_PATH}/{filename}'
-
-    try:
-        with open(filepath, 'rb') as pf:
-            eml_text_by_pid = pickle.load(pf)
-            print(f'Init harvest EML text... count={len(eml_text_by_pid)}')
-            return eml_text_by_pid
-    except FileNotFoundError:
-        pass
+    harvest(filelist, [(('dataset_title', 'dataset_abstract', *components), add_text)])
+    return ' '.join(text)
 
 
-def save_eml_text_by_pid():
-    global eml_text_by_pid
+def collect_text_for_scope(scope):
+    filelist = [filename for filename in get_existing_eml_files() if filename.startswith(scope)]
+    return collect_text_for_filelist(filelist, ('datatable_descriptions',))
 
-    filename = 'eml_text_by_pid.pkl'
-    filepath = f'{Config.DATA_FILES_PATH}/{filename}'
 
-    with open(filepath, 'wb') as pickle_file:
-        pickle.dump(eml_text_by_pid, pickle_file)
+def collect_text(pids):
+    return collect_text_for_filelist([pid + '.xml' for pid in pids], ())
 
 
 def clean_projects(projects):
     cleaned = []
     for project in projects:
-        project.project_title = clean_list(project.project_title)
-        project.project_abstract = clean_list(project.project_abstract)
-        cleaned.append(project)
+        cleaned.append(ProjectText(
+            project_title=clean_list(project.project_title),
+            project_abstract=clean_list(project.project_abstract)))
     return cleaned
 
 
 def clean_list(l):
-    return [nlp.clean(s, remove_digits=True) for s in l]
+    return [nlp.clean(s, remove_digits=True) for s in l if s]
+
+
+def get_eml_text_sink(conn, search_conn):
+    # A sink for harvest() that saves the files' text in the text store and indexes it for search
+    def save_eml_text(pid, facets):
+        projects, related_projects = facets['projects']
+        eml_text = EMLText(
+            dataset_title=clean_list(facets['dataset_title']),
+            dataset_abstract=clean_list(facets['dataset_abstract']),
+            dataset_keywords=clean_list(facets['dataset_keywords']),
+            datatable_descriptions=clean_list(facets['datatable_descriptions']),
+            dataset_geographic_descriptions=clean_list(facets['dataset_geographic_descriptions']),
+            method_step_descriptions=clean_list(facets['method_step_descriptions']),
+            projects=clean_projects(ProjectText(*project) for project in projects),
+            related_projects=clean_projects(ProjectText(*project) for project in related_projects)
+        )
+        text_store.put(conn, pid, eml_text._asdict())
+        search_index.put(search_conn, pid, get_text_by_component(eml_text))
 
+    return TEXT_FACETS, save_eml_text
 
-def harvest_eml_text(pids=None):
-    global eml_text_by_pid
 
+def harvest_eml_text(pids=None):
     if not pids:
-        pids = db.get_all_pids()
-
-    init_eml_text_by_pid()
-
-    count = len(eml_text_by_pid)
-    for pid in pids:
-        if eml_text_by_pid.get(pid):
-            continue
-        filename = pid + '.xml'
-        filepath = f'{Config.EML_FILES_PATH}/{filename}'
-        eml_node = xml_to_json(filepath)
-        if not eml_node:
-            continue
-
-        dataset_title = get_dataset_title(eml_node)
-        dataset_abstract = get_dataset_abstract(eml_node)
-        dataset_keywords = get_keywords(eml_node)
-        datatable_descriptions = get_data_table_descriptions(eml_node)
-        dataset_geographic_descriptions = get_dataset_geographic_descriptions(eml_node)
-        method_step_descriptions = get_method_step_descriptions(eml_node)
-        projects, related_projects = harvest_projects(eml_node)
-
-        eml_text_by_pid[pid] = EMLText(
-            dataset_title=clean_list(dataset_title),
-            dataset_abstract=clean_list(dataset_abstract),
-            dataset_keywords=clean_list(dataset_keywords),
-            datatable_descriptions=clean_list(datatable_descriptions),
-            dataset_geographic_descriptions=clean_list(dataset_geographic_descriptions),
-            method_step_descriptions=clean_list(method_step_descriptions),
-            projects=clean_projects(projects),
-            related_projects=clean_projects(related_projects)
-        )
-
-        count += 1
-        if count % 100 == 0:
-            print(f'Saving... count={count}')
-            save_eml_text_by_pid()
-
-    save_eml_text_by_pid()
+        pids = storage.get_storage().get_all_pids()
+
+    with text_store.get_conn() as conn, search_index.get_conn() as search_conn:
+        harvested_pids = text_store.get_pids(conn)
+        print(f'Init harvest EML text... count={len(harvested_pids)}')
+        filelist = [pid + '.xml' for pid in pids if pid not in harvested_pids]
+        text_facets, save_eml_text = get_eml_text_sink(conn, search_conn)
+        count = 0
+
+        def save(pid, facets):
+            nonlocal count
+            save_eml_text(pid, facets)
+            count += 1
+            if count % 100 == 0:
+                print(f'Saving... count={count}')
+                conn.commit()
+                search_conn.commit()
+
+        harvest(filelist, [(text_facets, save)])
+
+
+def get_eml_text(conn, pid, components=EMLText._fields):
+    # The PID's EMLText, with just the given components loaded and the others left empty, or None
+    eml_text = text_store.get(conn, pid, components)
+    if eml_text is None:
+        return None
+    for projects in ('projects', 'related_projects'):
+        if projects in eml_text:
+            eml_text[projects] = [ProjectText(*project) for project in eml_text[projects]]
+    return EMLText(**{field: eml_text.get(field, []) for field in EMLText._fields})
+
+
+def get_text_fields(components):
+    # The EMLText fields needed for the components
+    fields = [field for component, field in TEXT_FIELDS_BY_COMPONENT.items() if component in components]
+    if any(component in PROJECT_COMPONENTS for component in components):
+        fields.extend(('projects', 'related_projects'))
+    return fields
+
+
+def get_text_by_component(eml_text):
+    # {component name, e.g., 'DATASET_TITLE': [text, ...]} for each of the EMLTextComponents, as indexed by search_index
+    text_by_component = {component.name: getattr(eml_text, field)
+                         for component, field in TEXT_FIELDS_BY_COMPONENT.items()}
+    for component, projects, text in ((EMLTextComponents.PROJECT_TITLES, eml_text.projects, 'project_title'),
+                                      (EMLTextComponents.PROJECT_ABSTRACTS, eml_text.projects, 'project_abstract'),
+                                      (EMLTextComponents.RELATED_PROJECT_TITLES, eml_text.related_projects,
+                                       'project_title'),
+                                      (EMLTextComponents.RELATED_PROJECT_ABSTRACTS, eml_text.related_projects,
+                                       'project_abstract')):
+        text_by_component[component.name] = [s for project in projects for s in getattr(project, text)]
+    return text_by_component
 
 
 def concat_project_text(projects, related_projects,
@@ -570,12 +595,14 @@ def get_eml_text_as_string(pid, components=(EMLTextComponents.DATASET_TITLE,
                                             EMLTextComponents.PROJECT_TITLES,
                                             EMLTextComponents.PROJECT_ABSTRACTS,
                                             EMLTextComponents.RELATED_PROJECT_TITLES,
-                                            EMLTextComponents.RELATED_PROJECT_ABSTRACTS)):
-    if not eml_text_by_pid:
-        init_eml_text_by_pid()
+                                            EMLTextComponents.RELATED_PROJECT_ABSTRACTS),
+                           conn=None):
+    if conn is None:
+        with text_store.get_conn() as conn:
+            return get_eml_text_as_string(pid, components, conn)
 
     eml_string = ''
-    eml_text = eml_text_by_pid.get((pid))
+    eml_text = get_eml_text(conn, pid, get_text_fields(components))
     if not eml_text:
         return ''
     if EMLTextComponents.DATASET_TITLE in components:
@@ -606,27 +633,23 @@ def get_eml_text_as_string_by_name(givenname, surname,
                                             EMLTextComponents.RELATED_PROJECT_TITLES,
                                             EMLTextComponents.RELATED_PROJECT_ABSTRACTS)):
 
-    if not eml_text_by_pid:
-        init_eml_text_by_pid()
-
-    pids = db.get_pids_by_name(givenname, surname)
+    pids = storage.get_storage().get_pids_by_name(givenname, surname)
     eml_string = ''
-    for pid in pids:
-        eml_string += get_eml_text_as_string(pid, components)
+    with text_store.get_conn() as conn:
+        for pid in pids:
+            eml_string += get_eml_text_as_string(pid, components, conn)
     return eml_string
 
 
 def get_eml_keywords_by_name(givenname, surname):
-    if not eml_text_by_pid:
-        init_eml_text_by_pid()
-
-    pids = db.get_pids_by_name(givenname, surname)
+    pids = storage.get_storage().get_pids_by_name(givenname, surname)
     keywords = []
-    for pid in pids:
-        eml_text = eml_text_by_pid.get((pid))
-        if not eml_text:
-            continue
-        keywords.extend(eml_text.dataset_keywords)
+    with text_store.get_conn() as conn:
+        for pid in pids:
+            eml_text = get_eml_text(conn, pid, ('dataset_keywords',))
+            if not eml_text:
+                continue
+            keywords.extend(eml_text.dataset_keywords)
     return keywords
 
 
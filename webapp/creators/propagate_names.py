@@ -13,20 +13,20 @@
     6/1/21
 """
 from collections import namedtuple
-import os
 import daiquiri
 from flask import Flask, Blueprint, jsonify, request, current_app
 from unidecode import unidecode
-from lxml import etree
 
 from multidict import CIMultiDict
 
 from webapp.config import Config
 import webapp.creators.corrections as corrections
 import webapp.creators.creators as creators
-import webapp.creators.db as db
 import webapp.creators.nlp as nlp
 import webapp.creators.parse_eml as parse_eml
+import webapp.creators.search_index as search_index
+import webapp.creators.storage as storage
+import webapp.creators.text_store as text_store
 
 logger = daiquiri.getLogger(Config.LOG_FILE)
 
@@ -123,32 +123,18 @@ def similar_names(name1, name2, use_nicknames=True):
     return True
 
 
+def normalized_names(names):
+    return set(nlp.normalize_all([name.lower() for name in names if name]))
+
+
 def same_name_sets(surnames_1, surnames_2, givennames_1, givennames_2, use_nicknames=True):
-    hit = False
-    for surname_1 in surnames_1:
-        for surname_2 in surnames_2:
-            if surname_1 and surname_2 and nlp.normalize(surname_1.lower()) == nlp.normalize(surname_2.lower()):
-                hit = True
-                break
-    if not hit:
+    if not normalized_names(surnames_1) & normalized_names(surnames_2):
         return False
-    hit = False
-    for givenname_1 in givennames_1:
-        for givenname_2 in givennames_2:
-            if givenname_1 and givenname_2 and nlp.normalize(givenname_1.lower()) == nlp.normalize(givenname_2.lower()):
-                hit = True
-                break
-    return hit
+    return bool(normalized_names(givennames_1) & normalized_names(givennames_2))
 
 
 def similar_name_sets(surnames_1, surnames_2, givennames_1, givennames_2, use_nicknames=True):
-    hit = False
-    for surname_1 in surnames_1:
-        for surname_2 in surnames_2:
-            if surname_1 and surname_2 and nlp.normalize(surname_1.lower()) == nlp.normalize(surname_2.lower()):
-                hit = True
-                break
-    if not hit:
+    if not normalized_names(surnames_1) & normalized_names(surnames_2):
         return False
     hit = False
     for givenname_1 in givennames_1:
@@ -188,19 +174,13 @@ def merge_named_persons(named_person_1, named_person_2):
 
 
 def get_pids_by_scope():
-    conn = db.get_conn()
-
     scopes = {}
-    with conn.cursor() as cur:
-        query = f"select distinct pid, scope from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where not skip " \
-                f"order by scope, pid"
-        cur.execute(query)
-        results = cur.fetchall()
-
-        for pid, scope in results:
-            pids = scopes.get(scope, [])
-            pids.append(pid)
-            scopes[scope] = pids
+    query = f"select distinct pid, scope from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where not skip " \
+            f"order by scope, pid"
+    for pid, scope in storage.get_storage().stream_rows(query):
+        pids = scopes.get(scope, [])
+        pids.append(pid)
+        scopes[scope] = pids
     return scopes
 
 
@@ -215,86 +195,82 @@ def collect_names_1(creators_only=True):
     named_persons_by_surname = CIMultiDict()
     named_persons_by_pid = CIMultiDict()
 
-    conn = db.get_conn()
-
-    with conn.cursor() as cur:
-        where_clause = " and rp_type='creator' " if creators_only else ""
-        query = f"select * from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where not skip {where_clause}" \
-                f"order by pid, surname, givenname"
-        cur.execute(query)
-        results = cur.fetchall()
-
-        prev_pid = None
-        prev_surname = None
-        prev_givenname = None
-        prev_named_person = None
-        for serial_id, pid, rp_type, givenname, surname, organization, position, address, city, country, email, \
-            url, orcid, scope, _, _, organization_keywords, _ in results:
-            named_person = None
-            if pid == prev_pid:
-                if nlp.normalize(surname) == nlp.normalize(prev_surname):
-                    if similar_names(f'{givenname} {surname}', f'{prev_givenname} {prev_surname}'):
-                        # should have a prev_named_person; we will add to it
-                        named_person = prev_named_person
-            new = False
-            if not named_person:
-                new = True
-                named_person = NamedPerson(
-                    serial_id=set(),
-                    pid=set(),
-                    rp_type=set(),
-                    givenname=set(),
-                    surname=set(),
-                    organization=set(),
-                    position=set(),
-                    address=set(),
-                    city=set(),
-                    country=set(),
-                    email=set(),
-                    url=set(),
-                    orcid=set(),
-                    scope=set(),
-                    person_variants=set(),
-                    organization_keywords=set()
-                )
-            named_person.serial_id.add(serial_id)
-            named_person.pid.add(pid)
-            named_person.rp_type.add(rp_type)
-            named_person.givenname.add(givenname)
-            named_person.surname.add(surname)
-            if organization:
-                named_person.organization.add(organization)
-            if position:
-                named_person.position.add(position)
-            if address:
-                named_person.address.add(address)
-            if city:
-                named_person.city.add(city)
-            if country:
-                named_person.country.add(country)
-            if email:
-                emails = email.split(' ')
-                for email in emails:
-                    named_person.email.add(email.lower())
-            if url:
-                urls = url.split(' ')
-                for url in urls:
-                    named_person.url.add(url.lower())
-            if orcid:
-                named_person.orcid.add(orcid)
-            named_person.scope.add(scope)
-            named_person.person_variants.add(corrections.PersonVariant(surname, givenname, scope))
-            if organization_keywords:
-                named_person.organization_keywords.add(organization_keywords)
-
-            if new:
-                named_persons_by_pid.add(pid, named_person)
-                named_persons_by_surname.add(surname, named_person)
-
-            prev_givenname = givenname
-            prev_surname = surname
-            prev_pid = pid
-            prev_named_person = named_person
+    where_clause = " and rp_type='creator' " if creators_only else ""
+    query = f"select * from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} where not skip {where_clause}" \
+            f"order by pid, surname, givenname"
+    results = storage.get_storage().stream_rows(query)
+
+    prev_pid = None
+    prev_surname = None
+    prev_givenname = None
+    prev_named_person = None
+    for serial_id, pid, rp_type, givenname, surname, organization, position, address, city, country, email, \
+        url, orcid, scope, _, _, organization_keywords, _ in results:
+        named_person = None
+        if pid == prev_pid:
+            if nlp.normalize(surname) == nlp.normalize(prev_surname):
+                if similar_names(f'{givenname} {surname}', f'{prev_givenname} {prev_surname}'):
+                    # should have a prev_named_person; we will add to it
+                    named_person = prev_named_person
+        new = False
+        if not named_person:
+            new = True
+            named_person = NamedPerson(
+                serial_id=set(),
+                pid=set(),
+                rp_type=set(),
+                givenname=set(),
+                surname=set(),
+                organization=set(),
+                position=set(),
+                address=set(),
+                city=set(),
+                country=set(),
+                email=set(),
+                url=set(),
+                orcid=set(),
+                scope=set(),
+                person_variants=set(),
+                organization_keywords=set()
+            )
+        named_person.serial_id.add(serial_id)
+        named_person.pid.add(pid)
+        named_person.rp_type.add(rp_type)
+        named_person.givenname.add(givenname)
+        named_person.surname.add(surname)
+        if organization:
+            named_person.organization.add(organization)
+        if position:
+            named_person.position.add(position)
+        if address:
+            named_person.address.add(address)
+        if city:
+            named_person.city.add(city)
+        if country:
+            named_person.country.add(country)
+        if email:
+            emails = email.split(' ')
+            for email in emails:
+                named_person.email.add(email.lower())
+        if url:
+            urls = url.split(' ')
+            for url in urls:
+                named_person.url.add(url.lower())
+        if orcid:
+            named_person.orcid.add(orcid)
+        named_person.scope.add(scope)
+        named_person.person_variants.add(corrections.PersonVariant(surname, givenname, scope))
+        if organization_keywords:
+            named_person.organization_keywords.add(organization_keywords)
+
+        if new:
+            named_persons_by_pid.add(pid, named_person)
+            named_persons_by_surname.add(surname, named_person)
+
+        prev_givenname = givenname
+        prev_surname = surname
+        prev_pid = pid
+        prev_named_person = named_person
     return named_persons_by_surname, named_persons_by_pid
 
 
@@ -495,20 +471,22 @@ def find_cross_scope_names(scopes, creators_only=False, person_variants_lookup=N
 def propagate_orcids(correction_code):
     global named_persons_by_surname
 
-    conn = db.get_conn()
-    with conn.cursor() as cur:
-        surnames = sorted(list(set(named_persons_by_surname.keys())))
-        for surname in surnames:
-            named_persons = named_persons_by_surname.getall(surname, [])
-            for named_person in named_persons:
-                serial_id, *_, orcid, _, _, _ = named_person
-                if not orcid:
-                    continue
-                serial_ids = ','.join(sorted([str(id) for id in serial_id]))
-                query = f"update {Config.RESPONSIBLE_PARTIES_TABLE_NAME} set orcid='{list(orcid)[0]}', correction_codes='{correction_code}' " \
-                        f" where serial_id in ({serial_ids}) and orcid=''"
-                cur.execute(query)
-                conn.commit()
+    # Map each serial_id to the ORCID of its named person. If a serial_id belongs to more than one named person,
+    #  the first, in surname order, wins.
+    orcids_by_serial_id = {}
+    surnames = sorted(list(set(named_persons_by_surname.keys())))
+    for surname in surnames:
+        named_persons = named_persons_by_surname.getall(surname, [])
+        for named_person in named_persons:
+            serial_id, *_, orcid, _, _, _ = named_person
+            if not orcid:
+                continue
+            orcid = list(orcid)[0]
+            for id in serial_id:
+                orcids_by_serial_id.setdefault(id, orcid)
+
+    rows = [(serial_id, orcid, str(correction_code)) for serial_id, orcid in orcids_by_serial_id.items()]
+    storage.get_storage().propagate_orcids(rows)
 
 
 def get_lter_sites():
@@ -615,70 +593,72 @@ def save_creator_names():
         names_file.write(str(creator_names))
 
 
-def set_organization_keywords_in_db():
-    with open(f'{Config.DATA_FILES_PATH}/{Config.ORGANIZATIONS_FILE}', 'r') as organizations_file:
-        xml = organizations_file.read()
-
-    conn = db.get_conn()
-    with conn.cursor() as cur:
-        root = etree.fromstring(xml.encode("utf-8"))
-        organization_elements = root.findall('organization')
-        for organization_element in organization_elements:
-            name_elements = organization_element.findall('name')
-            email_elements = organization_element.findall('email')
-            keyword = organization_element.find('keyword').text
-            subqueries = []
-            for name_element in name_elements:
-                subqueries.append(f"organization like '%{name_element.text}%'")
-                subqueries.append(f"address like '%{name_element.text}%'")
-            for email_element in email_elements:
-                subqueries.append(f"email like '%@{email_element.text}%'")
-                subqueries.append(f"email like '%.{email_element.text}%'")
-                subqueries.append(f"url like '%/{email_element.text}'")
-                subqueries.append(f"url like '%.{email_element.text}'")
-            subquery = ' or '.join(subqueries)
-            query = f"update {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
-                    f"set organization_keywords=concat(organization_keywords, ' {keyword}') " \
-                    f"where ({subquery}) and rp_type='creator' and not skip"
-            cur.execute(query)
-
-
 def init_responsible_parties_raw_db():
-    filename = Config.RESPONSIBLE_PARTIES_TEXT_FILE
-    os.remove(f'{Config.EML_FILES_PATH}/{filename}')
+    store = storage.get_storage()
+    store.migrate()
+    filename = Config.RESPONSIBLE_PARTIES_RECORDS_FILE
     log_info('Collect responsible parties')
     parse_eml.collect_responsible_parties(filename, trace=True)
 
     log_info('Clear raw responsible parties db')
-    conn = db.get_conn()
-    with conn.cursor() as cur:
-        query = f'delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME}'
-        cur.execute(query)
+    store.clear_raw_rows()
 
     log_info('Build raw responsible parties db')
-    db.build_responsible_party_raw_db(filename)
-    log_info('Remove duplicates from raw responsible parties db')
-    db.remove_duplicate_records(table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
-
-
-def gather_and_prepare_data(added_package_ids=None, removed_package_ids=None):
-    filename = Config.RESPONSIBLE_PARTIES_TEXT_FILE
+    store.build_responsible_party_raw_db(filename)
+    store.analyze(Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
+    # The cleaned table needs to be rebuilt from the new raw table
+    store.set_cleaning_fingerprint(None)
+
+
+def clean_responsible_parties(table_name):
+    # The rows were cleaned and tagged with their organization keywords as they were copied from the raw table.
+    #  Here, we apply the corrections.
+    store = storage.get_storage()
+    store.make_orcid_corrections(table_name=table_name)
+    store.apply_overrides(table_name=table_name)
+
+
+def gather_and_prepare_data(added_package_ids=None, removed_package_ids=None, full_rebuild=False):
+    store = storage.get_storage()
+    store.migrate()
+    # The ORCIDs propagated last time are cleared, so they're propagated afresh from the cleaned rows rather than
+    #  taken as evidence by process_names, which would make the results depend on what was propagated before
+    store.clear_propagated_orcids()
+    filename = Config.RESPONSIBLE_PARTIES_RECORDS_FILE
+    # Before harvesting, since a repair removes and adds the same PID
+    text_store.delete_pids(removed_package_ids)
+    search_index.delete_pids(removed_package_ids)
     parse_eml.collect_responsible_parties(filename, added_package_ids, removed_package_ids)
-    responsible_parties = db.parse_responsible_parties_file(filename)
-    db.prune_pids(responsible_parties, removed_package_ids)
-    # Prune added pids, too, because we may have already run this today. They'll just get added back in.
-    db.prune_pids(responsible_parties, added_package_ids)
-    db.build_responsible_party_raw_db(filename, added_package_ids)
-    db.remove_duplicate_records(table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
-    db.init_responsible_parties_table(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
-                                      raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
-    db.fix_misplaced_middle_initials(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    db.clean_database_text(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    db.normalize_db_text(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    db.clean_responsible_party_orcids(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    db.make_orcid_corrections(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    db.apply_overrides(table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME)
-    set_organization_keywords_in_db()
+    store.build_responsible_party_raw_db(filename, added_package_ids, removed_package_ids)
+    store.analyze(Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
+
+    # The cleaning stages work row by row, so the cleaned table can be maintained incrementally, cleaning just the
+    #  rows for the added PIDs. If the corrections files have changed, though, all the rows need to be re-cleaned.
+    fingerprint = corrections.get_cleaning_fingerprint()
+    if full_rebuild or added_package_ids is None or fingerprint != store.get_cleaning_fingerprint() or \
+            store.count_rows(Config.RESPONSIBLE_PARTIES_TABLE_NAME) == 0:
+        # Rebuild in the shadow table and swap it in only once it's complete. If the rebuild fails, the live table
+        #  is left as it was, but will be rebuilt the next time through.
+        log_info('Rebuild responsible parties db')
+        store.set_cleaning_fingerprint(None)
+        store.create_shadow_table()
+        store.init_responsible_parties_table(table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME,
+                                             raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
+        store.create_shadow_indexes()
+        clean_responsible_parties(Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+        store.analyze(Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+        store.swap_shadow_table()
+        store.set_cleaning_fingerprint(fingerprint)
+    else:
+        changed_pids = set(added_package_ids or []) | set(removed_package_ids or [])
+        if not changed_pids:
+            return
+        log_info(f'Update responsible parties db for {len(changed_pids)} PIDs')
+        store.init_responsible_parties_table(table_name=Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME,
+                                             raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME,
+                                             pids=added_package_ids)
+        clean_responsible_parties(Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME)
+        store.replace_responsible_parties(changed_pids)
 
 
 def process_names():
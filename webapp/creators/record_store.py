@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: record_store
+
+:Synopsis:
+    The store of the responsible parties collected from the EML files, from which the raw responsible parties table
+    is built. It's a file of JSON lines in Config.EML_FILES_PATH, one per responsible party, e.g.,
+        {"pid": "edi.1.1", "rp_type": "creator", "values": [["givenName", "Jane"], ["surName", "Doe"]]}
+    with an index alongside it that gives, for each PID, the byte range its responsible parties occupy. A PID's
+    responsible parties are always written together, so they occupy a single range.
+
+    A PID is deleted by appending a tombstone, e.g., {"pid": "edi.1.1", "deleted": true}, and dropping it from the
+    index, so the file is only ever appended to. The space taken by deleted records is reclaimed by compaction, which
+    rewrites the file with just the live records once more than Config.RECORD_STORE_COMPACT_FRACTION of it is dead.
+    Loading the records for some PIDs reads just their ranges. Loading all of them reads the file once, in order.
+
+    The index records the size of the file it describes. If the two don't agree, e.g., because the process was
+    killed while appending, the index is rebuilt by replaying the file, tombstones included. The store can be
+    compacted by hand with:
+        python -m webapp.creators.record_store compact
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+
+from webapp.config import Config
+
+
+def get_filepath(filename):
+    return f'{Config.EML_FILES_PATH}/{filename}'
+
+
+def get_index_filepath(filename):
+    return f'{get_filepath(filename)}.index'
+
+
+def get_size(filename):
+    try:
+        return os.path.getsize(get_filepath(filename))
+    except FileNotFoundError:
+        return 0
+
+
+def encode(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def write_index(filename, index):
+    # Write to a temporary file and rename it, so a reader never sees a partial index
+    index_filepath = get_index_filepath(filename)
+    with open(f'{index_filepath}.tmp', 'w', encoding='utf-8') as index_file:
+        json.dump({'size': get_size(filename), 'pids': index}, index_file, separators=(',', ':'))
+    os.replace(f'{index_filepath}.tmp', index_filepath)
+
+
+def rebuild_index(filename):
+    index = {}
+    offset = 0
+    filepath = get_filepath(filename)
+    if os.path.exists(filepath):
+        with open(filepath, 'r+b') as records_file:
+            for line in records_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A record left incomplete by an interrupted append. Drop it and anything after it.
+                    records_file.truncate(offset)
+                    break
+                pid = record['pid']
+                if record.get('deleted'):
+                    index.pop(pid, None)
+                elif index.get(pid, [None, None])[1] == offset:
+                    index[pid][1] = offset + len(line)
+                else:
+                    index[pid] = [offset, offset + len(line)]
+                offset += len(line)
+    write_index(filename, index)
+    return index
+
+
+def load_index(filename):
+    # Returns {pid: [start, end]}
+    try:
+        with open(get_index_filepath(filename), 'r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if index['size'] == get_size(filename):
+            return index['pids']
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    return rebuild_index(filename)
+
+
+def clear(filename):
+    for filepath in (get_filepath(filename), get_index_filepath(filename)):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+
+def delete_pids(filename, pids):
+    index = load_index(filename)
+    pids = [pid for pid in dict.fromkeys(pids or []) if pid in index]
+    if not pids:
+        return
+    with open(get_filepath(filename), 'ab') as records_file:
+        records_file.writelines(encode({'pid': pid, 'deleted': True}) for pid in pids)
+    for pid in pids:
+        del index[pid]
+    write_index(filename, index)
+
+
+@contextmanager
+def open_appender(filename):
+    # Yields append(pid, [(pid, rp_type, [(tag, value), ...]), ...]), which appends a PID's responsible parties,
+    #  replacing any already in the store. The index is written when the appender is closed.
+    index = load_index(filename)
+    with open(get_filepath(filename), 'ab') as records_file:
+        offset = records_file.tell()
+
+        def append(pid, responsible_parties):
+            nonlocal offset
+            if not responsible_parties:
+                return
+            if pid in index:
+                offset += records_file.write(encode({'pid': pid, 'deleted': True}))
+            start = offset
+            for _, rp_type, values in responsible_parties:
+                offset += records_file.write(encode({'pid': pid, 'rp_type': rp_type, 'values': values}))
+            index[pid] = [start, offset]
+
+        try:
+            yield append
+        finally:
+            records_file.flush()
+            write_index(filename, index)
+
+
+def append_responsible_parties(filename, results):
+    # results yields (pid, responsible parties), as eml_extractor.extract_all_responsible_parties does
+    with open_appender(filename) as append:
+        for pid, responsible_parties in results:
+            append(pid, responsible_parties)
+
+
+def get_runs(ranges):
+    # Merge adjacent ranges, so runs of records can be read straight through
+    runs = []
+    for start, end in sorted(ranges):
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return runs
+
+
+def read_responsible_parties(filename, pids=None):
+    # Yields (pid, rp_type, [(tag, value), ...]) for each of the live records for the PIDs, or for all the PIDs if
+    #  pids is None, in the order they were appended
+    index = load_index(filename)
+    if pids is None:
+        ranges = index.values()
+    else:
+        ranges = [index[pid] for pid in dict.fromkeys(pids) if pid in index]
+    if not ranges:
+        return
+    with open(get_filepath(filename), 'rb') as records_file:
+        for start, end in get_runs(ranges):
+            records_file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                line = records_file.readline()
+                remaining -= len(line)
+                record = json.loads(line)
+                yield record['pid'], record['rp_type'], [tuple(value) for value in record['values']]
+
+
+def get_dead_bytes(filename, index):
+    return get_size(filename) - sum(end - start for start, end in index.values())
+
+
+def compact(filename):
+    index = load_index(filename)
+    filepath = get_filepath(filename)
+    new_index = {}
+    offset = 0
+    with open(filepath, 'rb') as records_file, open(f'{filepath}.tmp', 'wb') as new_records_file:
+        for pid, (start, end) in sorted(index.items(), key=lambda item: item[1]):
+            records_file.seek(start)
+            new_records_file.write(records_file.read(end - start))
+            new_index[pid] = [offset, offset + end - start]
+            offset += end - start
+    os.replace(f'{filepath}.tmp', filepath)
+    write_index(filename, new_index)
+
+
+def compact_if_needed(filename):
+    index = load_index(filename)
+    size = get_size(filename)
+    if size and get_dead_bytes(filename, index) > size * Config.RECORD_STORE_COMPACT_FRACTION:
+        compact(filename)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['compact']:
+        compact(Config.RESPONSIBLE_PARTIES_RECORDS_FILE)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: responsible_party_rows
+
+:Synopsis:
+    The columns of the responsible parties tables, and the rows of the raw table, as built from the responsible
+    parties record store. These are the same for both storage backends, so they're kept apart from either backend's
+    code, and the SQLite backend doesn't need psycopg2. See storage.py.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import itertools
+
+import webapp.creators.record_store as record_store
+
+
+RESPONSIBLE_PARTIES_RAW_COLUMNS = ('pid', 'rp_type', 'givenname', 'surname', 'organization', 'position', 'address',
+                                   'city', 'country', 'email', 'url', 'orcid', 'scope', 'identifier')
+RESPONSIBLE_PARTIES_COLUMNS = ('serial_id',) + RESPONSIBLE_PARTIES_RAW_COLUMNS + \
+                              ('correction_codes', 'organization_keywords', 'skip')
+
+
+def find_entries(line, tag):
+    entries = []
+    for item in line:
+        if item[0] == tag:
+            entries.append(item[1])
+    return ' '.join(entries)
+
+
+def generate_responsible_party_raw_rows(responsible_parties):
+    for pid, rp_type, vals in responsible_parties:
+        givenname = find_entries(vals, 'givenName')
+        surname = find_entries(vals, 'surName')  # FIXME
+        organization = find_entries(vals, 'organizationName')
+        position = find_entries(vals, 'positionName')
+        address = find_entries(vals, 'deliveryPoint')
+        city = find_entries(vals, 'city').replace("'", "")
+        country = find_entries(vals, 'country').replace("'", "")
+        email = find_entries(vals, 'electronicMailAddress')
+        url = find_entries(vals, 'onlineUrl')
+        orcid = find_entries(vals, 'userId')
+        scope, identifier, version = pid.split('.')
+        yield (pid, rp_type, givenname, surname, organization, position, address, city, country, email, url, orcid,
+               scope, identifier)
+
+
+def remove_duplicate_rows(rows):
+    # Rows with the same pid, rp_type, and name are duplicates, and the raw table has a unique index that rejects
+    #  them. As with the full-table dedupe this replaces, the last of the duplicates is the one kept, in its place.
+    #  The record store yields each PID's rows together, so duplicates are found within a PID's rows, and only one
+    #  PID's rows are held at a time.
+    for _, pid_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        last_rows = {}
+        for row in pid_rows:
+            _, rp_type, givenname, surname, *_ = row
+            key = (rp_type, surname, givenname)
+            # Moved to the end, so the rows come out in the order of their last occurrences
+            last_rows.pop(key, None)
+            last_rows[key] = row
+        yield from last_rows.values()
+
+
+def read_responsible_party_raw_rows(filename, added_package_ids=None):
+    responsible_parties = record_store.read_responsible_parties(filename, added_package_ids)
+    return remove_duplicate_rows(generate_responsible_party_raw_rows(responsible_parties))
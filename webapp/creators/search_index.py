@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: search_index
+
+:Synopsis:
+    A full-text index of the text harvested from the EML files (see parse_eml.harvest_eml_text), for finding data
+    packages, and their creators, by what the packages are about. It's kept in a SQLite database in the snapshot
+    directory, so a read-only server answers searches from its copy of the snapshot, like the other GET APIs.
+
+    A PID's text is indexed as it's harvested, so the index is kept up to date as the names are updated. It's
+    indexed by component, i.e., by parse_eml.EMLTextComponents, e.g., DATASET_TITLE, recording for each term the
+    PIDs whose text includes it, and how many times in each component. A PID's entries are replaced when its text
+    is harvested again, and removed when the PID is removed. The canonical names of each PID's creators are saved
+    in the index along with the rest of the snapshot.
+
+    Searches are scored with BM25F: a term's count in each component is normalized by the component's length
+    relative to its average length, and weighted by Config.SEARCH_TEXT_WEIGHTS, and the weighted counts are summed
+    before BM25's saturation is applied. A creator's score is the sum of the scores of the data packages they
+    created. The index can be rebuilt from the text store, without parsing the EML files, with:
+        python -m webapp.creators.search_index rebuild
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import heapq
+import json
+import math
+import os
+from pathlib import Path
+import re
+import sqlite3
+import sys
+
+from unidecode import unidecode
+
+from webapp.config import Config
+import webapp.creators.snapshot as snapshot
+
+
+# The harvested text has had its punctuation and digits removed by nlp.clean. A query is tokenized the same way.
+TOKEN_PATTERN = re.compile(r'[a-z]{2,}')
+
+# Terms too common to be worth indexing
+STOP_WORDS = frozenset((
+    'about', 'after', 'all', 'also', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'been', 'before', 'between',
+    'both', 'but', 'by', 'can', 'did', 'do', 'does', 'during', 'each', 'for', 'from', 'had', 'has', 'have', 'he',
+    'her', 'his', 'how', 'if', 'in', 'into', 'is', 'it', 'its', 'may', 'more', 'most', 'no', 'not', 'of', 'on',
+    'one', 'only', 'or', 'other', 'our', 'over', 'she', 'should', 'so', 'some', 'such', 'than', 'that', 'the',
+    'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'through', 'to', 'under', 'up', 'was',
+    'we', 'were', 'what', 'when', 'where', 'which', 'while', 'who', 'will', 'with', 'within', 'would'
+))
+
+SCHEMA = (
+    "create table if not exists documents (pid text primary key)",
+    # The total length of each component over all of the documents, for the average lengths
+    "create table if not exists totals (component text primary key, length integer)",
+    # length is the length of the PID's text for the component, in terms
+    "create table if not exists postings (term text, pid text, component text, tf integer, length integer, "
+    "primary key (term, pid, component)) without rowid",
+    "create index if not exists postings_pid_idx on postings (pid)",
+    "create table if not exists creators (pid text, name text, primary key (pid, name)) without rowid",
+)
+
+
+def get_filepath():
+    return snapshot.get_snapshot_filepath(snapshot.SEARCH_INDEX_FILE)
+
+
+@contextmanager
+def get_conn():
+    os.makedirs(Config.SNAPSHOT_PATH, exist_ok=True)
+    conn = sqlite3.connect(get_filepath(), timeout=Config.SQLITE_TIMEOUT)
+    try:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@contextmanager
+def get_read_conn():
+    # Opened read-only, so a search never writes to the snapshot. Raises FileNotFoundError if there's no index.
+    filepath = get_filepath()
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath)
+    conn = sqlite3.connect(f'{Path(filepath).resolve().as_uri()}?mode=ro', uri=True, timeout=Config.SQLITE_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(unidecode(text).lower()) if token not in STOP_WORDS]
+
+
+def delete(conn, pids):
+    for pid in pids:
+        lengths = conn.execute("select distinct component, length from postings where pid=?", (pid,)).fetchall()
+        conn.executemany("update totals set length=length-? where component=?",
+                         ((length, component) for component, length in lengths))
+        conn.execute("delete from postings where pid=?", (pid,))
+        conn.execute("delete from documents where pid=?", (pid,))
+
+
+def put(conn, pid, text_by_component):
+    # text_by_component is {component name, e.g., 'DATASET_TITLE': [text, ...]}. Replaces the PID's entries, if any.
+    delete(conn, [pid])
+    conn.execute("insert into documents (pid) values (?)", (pid,))
+    for component, texts in text_by_component.items():
+        term_counts = Counter(token for text in texts for token in tokenize(text))
+        if not term_counts:
+            continue
+        length = sum(term_counts.values())
+        conn.execute("insert into totals (component, length) values (?, ?) "
+                     "on conflict (component) do update set length=length+excluded.length", (component, length))
+        conn.executemany("insert into postings (term, pid, component, tf, length) values (?, ?, ?, ?, ?)",
+                         ((term, pid, component, tf, length) for term, tf in term_counts.items()))
+
+
+def delete_pids(pids):
+    # Nothing to do if there's no index
+    if not pids or not os.path.exists(get_filepath()):
+        return
+    with get_conn() as conn:
+        delete(conn, pids)
+
+
+def save_creators(creators_by_pid):
+    # creators_by_pid is {pid: canonical names of the PID's creators}
+    with get_conn() as conn:
+        conn.execute("delete from creators")
+        conn.executemany("insert or ignore into creators (pid, name) values (?, ?)",
+                         ((pid, name) for pid, names in creators_by_pid.items() for name in names))
+
+
+def get_scores(conn, terms):
+    # Returns {pid: score} for the PIDs whose text includes any of the terms
+    weights = {component: weight for component, weight in Config.SEARCH_TEXT_WEIGHTS.items() if weight}
+    k1, b = Config.SEARCH_TEXT_K1, Config.SEARCH_TEXT_B
+    document_count = conn.execute("select count(*) from documents").fetchone()[0]
+    if not document_count:
+        return {}
+    average_lengths = {component: length / document_count
+                       for component, length in conn.execute("select component, length from totals")}
+    scores = defaultdict(float)
+    for term in terms:
+        weighted_tfs = defaultdict(float)
+        for pid, component, tf, length in conn.execute(
+                "select pid, component, tf, length from postings where term=?", (term,)):
+            weight = weights.get(component)
+            if weight:
+                weighted_tfs[pid] += weight * tf / (1 - b + b * length / average_lengths[component])
+        document_frequency = len(weighted_tfs)
+        idf = math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        for pid, weighted_tf in weighted_tfs.items():
+            scores[pid] += idf * weighted_tf * (k1 + 1) / (k1 + weighted_tf)
+    return scores
+
+
+def search(query, limit=None):
+    # Returns the best-scoring PIDs and creators, up to limit of each, as
+    #  {'pids': [{'pid': pid, 'score': score}, ...],
+    #   'creators': [{'name': canonical name, 'score': score, 'pids': [pid, ...]}, ...]}
+    #  with a creator's PIDs being the best-scoring of the PIDs they created, up to limit of them
+    limit = limit or Config.SEARCH_TEXT_LIMIT
+    terms = list(dict.fromkeys(tokenize(query)))
+    with get_read_conn() as conn:
+        scores = get_scores(conn, terms)
+        creator_pids = defaultdict(list)
+        if scores:
+            creators_query = "select pid, name from creators where pid in (select value from json_each(?))"
+            for pid, name in conn.execute(creators_query, (json.dumps(list(scores)),)):
+                creator_pids[name].append(pid)
+
+    def by_score(pid):
+        return -scores[pid], pid
+
+    best_pids = heapq.nsmallest(limit, scores, key=by_score)
+    creator_scores = {name: sum(scores[pid] for pid in pids) for name, pids in creator_pids.items()}
+    best_creators = heapq.nsmallest(limit, creator_scores, key=lambda name: (-creator_scores[name], name))
+    return {
+        'pids': [{'pid': pid, 'score': round(scores[pid], 4)} for pid in best_pids],
+        'creators': [{'name': name, 'score': round(creator_scores[name], 4),
+                      'pids': sorted(creator_pids[name], key=by_score)[:limit]} for name in best_creators]
+    }
+
+
+def rebuild():
+    # The creators are left as they are. They're saved with the snapshot.
+    import webapp.creators.parse_eml as parse_eml
+    import webapp.creators.text_store as text_store
+    with text_store.get_conn() as text_conn, get_conn() as conn:
+        conn.execute("delete from postings")
+        conn.execute("delete from totals")
+        conn.execute("delete from documents")
+        for pid in sorted(text_store.get_pids(text_conn)):
+            put(conn, pid, parse_eml.get_text_by_component(parse_eml.get_eml_text(text_conn, pid)))
+    with get_conn() as conn:
+        conn.execute("vacuum")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['rebuild']:
+        rebuild()
+    elif sys.argv[1:2] == ['search']:
+        print(json.dumps(search(' '.join(sys.argv[2:])), indent=2))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: snapshot
+
+:Synopsis:
+    Save and load the precomputed data needed to serve the GET APIs. A server running with Config.READ_ONLY
+    serves these APIs from the snapshot directory alone, without a database connection.
+
+    The snapshot directory, Config.SNAPSHOT_PATH, contains:
+        creator_names.txt - canonical names and their variants, including the variants for overridden names
+        names_for_scope.txt - for each scope, the canonical names of the creators in that scope
+        old_dups.txt - the possible dups saved as of the last flush, used to mark new possible dups
+        search_index.sqlite3 - the full-text index of the harvested EML text, and each PID's creators (see
+            search_index.py)
+
+    A server running normally saves the snapshot each time the names are updated. The snapshot directory can
+    then be copied to the read-only servers.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+import ast
+import os
+
+from webapp.config import Config
+
+CREATOR_NAMES_FILE = 'creator_names.txt'
+NAMES_FOR_SCOPE_FILE = 'names_for_scope.txt'
+OLD_DUPS_FILE = 'old_dups.txt'
+SEARCH_INDEX_FILE = 'search_index.sqlite3'
+
+# Key is snapshot filename, value is (mtime, data). A file is re-read only when it has been replaced.
+snapshot_cache = {}
+
+
+def get_snapshot_filepath(filename):
+    return f'{Config.SNAPSHOT_PATH}/{filename}'
+
+
+def write_snapshot_file(filename, data):
+    # Write to a temporary file and rename it, so a reader never sees a partially-written file
+    filepath = get_snapshot_filepath(filename)
+    temp_filepath = f'{filepath}.tmp'
+    with open(temp_filepath, 'w', encoding='utf-8') as snapshot_file:
+        snapshot_file.write(str(data))
+    os.replace(temp_filepath, filepath)
+
+
+def read_snapshot_file(filename):
+    filepath = get_snapshot_filepath(filename)
+    mtime = os.stat(filepath).st_mtime_ns
+    cached = snapshot_cache.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(filepath, 'r', encoding='utf-8-sig') as snapshot_file:
+        data = ast.literal_eval(snapshot_file.read())
+    snapshot_cache[filename] = (mtime, data)
+    return data
+
+
+def save_snapshot(creator_names, names_for_scope, old_dups):
+    os.makedirs(Config.SNAPSHOT_PATH, exist_ok=True)
+    write_snapshot_file(NAMES_FOR_SCOPE_FILE, names_for_scope)
+    write_snapshot_file(OLD_DUPS_FILE, old_dups)
+    # Written last, so a reader that sees the new names also sees the scopes that go with them
+    write_snapshot_file(CREATOR_NAMES_FILE, creator_names)
+
+
+def save_old_dups(old_dups):
+    os.makedirs(Config.SNAPSHOT_PATH, exist_ok=True)
+    write_snapshot_file(OLD_DUPS_FILE, old_dups)
+
+
+def load_creator_names():
+    return read_snapshot_file(CREATOR_NAMES_FILE)
+
+
+def load_names_for_scope():
+    return read_snapshot_file(NAMES_FOR_SCOPE_FILE)
+
+
+def load_old_dups():
+    try:
+        return read_snapshot_file(OLD_DUPS_FILE)
+    except FileNotFoundError:
+        return {}
@@ -0,0 +1,598 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: storage
+
+:Synopsis:
+    The storage operations the pipeline and the web app need -- bulk loading of the raw table, per-PID deletes,
+    building and cleaning the responsible parties table, ORCID updates, and scans of the tables -- with two
+    implementations, selected by Config.STORAGE_BACKEND:
+
+        'postgres': the PostgreSQL database, via the functions in db.py
+        'sqlite':   an embedded SQLite database in the file Config.SQLITE_DB_PATH
+
+    With the SQLite backend, the whole pipeline runs in-process, with no database server, so it can be run,
+    benchmarked, and profiled anywhere. The queries passed to stream_rows() are written in SQL that both backends
+    understand, with %s placeholders. The SQLite database file is attached to each connection as eml_files, so the
+    table names in the configuration work as they are.
+
+    To time the raw table build and the full rebuild of the responsible parties table with a given backend, from
+    the responsible parties record store already collected:
+        python -m webapp.creators.storage sqlite
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+import sqlite3
+
+from webapp.config import Config
+import webapp.creators.cleaning as cleaning
+import webapp.creators.corrections as corrections
+import webapp.creators.responsible_party_rows as responsible_party_rows
+
+
+class Storage(ABC):
+    name = None
+
+    @abstractmethod
+    def migrate(self):
+        pass
+
+    @abstractmethod
+    def stream_rows(self, query, params=None):
+        pass
+
+    @abstractmethod
+    def fetch_rows(self, query, params=None):
+        pass
+
+    @abstractmethod
+    def analyze(self, table_name):
+        pass
+
+    @abstractmethod
+    def count_rows(self, table_name):
+        pass
+
+    @abstractmethod
+    def get_cleaning_fingerprint(self):
+        pass
+
+    @abstractmethod
+    def set_cleaning_fingerprint(self, fingerprint):
+        pass
+
+    @abstractmethod
+    def get_all_pids(self):
+        pass
+
+    @abstractmethod
+    def get_pids_by_name(self, givenname, surname):
+        pass
+
+    @abstractmethod
+    def load_raw_rows(self, rows, pids_to_delete=None):
+        pass
+
+    @abstractmethod
+    def clear_raw_rows(self):
+        pass
+
+    @abstractmethod
+    def delete_pids(self, pids):
+        pass
+
+    @abstractmethod
+    def init_responsible_parties_table(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                       raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME, pids=None):
+        pass
+
+    @abstractmethod
+    def replace_responsible_parties(self, pids):
+        pass
+
+    @abstractmethod
+    def create_shadow_table(self):
+        pass
+
+    @abstractmethod
+    def create_shadow_indexes(self):
+        pass
+
+    @abstractmethod
+    def swap_shadow_table(self):
+        pass
+
+    @abstractmethod
+    def make_orcid_corrections(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        pass
+
+    @abstractmethod
+    def apply_overrides(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        pass
+
+    @abstractmethod
+    def propagate_orcids(self, rows):
+        pass
+
+    @abstractmethod
+    def clear_propagated_orcids(self):
+        pass
+
+    # Only the PostgreSQL backend keeps statistics on its queries
+    def reset_query_stats(self):
+        pass
+
+    def log_query_summary(self, title):
+        pass
+
+    def build_responsible_party_raw_db(self, filename, added_package_ids=None, removed_package_ids=None):
+        if added_package_ids == [] and not removed_package_ids:
+            return
+        rows = []
+        if added_package_ids != []:
+            rows = responsible_party_rows.read_responsible_party_raw_rows(filename, added_package_ids)
+        if added_package_ids is None:
+            # All of the file's rows are loaded, so they replace all of the rows in the table
+            self.clear_raw_rows()
+        # The added PIDs may have been loaded already, e.g., if we've already run today. Replace them.
+        pids_to_delete = set(added_package_ids or []) | set(removed_package_ids or [])
+        self.load_raw_rows(rows, pids_to_delete)
+
+
+class PostgresStorage(Storage):
+    name = 'postgres'
+
+    def __init__(self):
+        # Imported here, so the SQLite backend doesn't need psycopg2 or a PostgreSQL database
+        import webapp.creators.db as db
+        import webapp.creators.migrations as migrations
+        self.db = db
+        self.migrations = migrations
+
+    def migrate(self):
+        self.migrations.migrate()
+
+    def reset_query_stats(self):
+        self.db.reset_query_stats()
+
+    def log_query_summary(self, title):
+        self.db.log_query_summary(title)
+
+    def stream_rows(self, query, params=None):
+        return self.db.stream_rows(query, params)
+
+    def fetch_rows(self, query, params=None):
+        return self.db.fetch_rows(query, params)
+
+    def analyze(self, table_name):
+        self.db.analyze(table_name)
+
+    def count_rows(self, table_name):
+        return self.db.count_rows(table_name)
+
+    def get_cleaning_fingerprint(self):
+        return self.db.get_cleaning_fingerprint()
+
+    def set_cleaning_fingerprint(self, fingerprint):
+        self.db.set_cleaning_fingerprint(fingerprint)
+
+    def get_all_pids(self):
+        return self.db.get_all_pids()
+
+    def get_pids_by_name(self, givenname, surname):
+        return self.db.get_pids_by_name(givenname, surname)
+
+    def load_raw_rows(self, rows, pids_to_delete=None):
+        self.db.load_raw_rows(rows, pids_to_delete)
+
+    def clear_raw_rows(self):
+        self.db.clear_raw_rows()
+
+    def delete_pids(self, pids):
+        self.db.delete_pids(pids)
+
+    def init_responsible_parties_table(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                       raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME, pids=None):
+        self.db.init_responsible_parties_table(table_name=table_name, raw_table_name=raw_table_name, pids=pids)
+
+    def replace_responsible_parties(self, pids):
+        self.db.replace_responsible_parties(pids)
+
+    def create_shadow_table(self):
+        self.db.create_shadow_table()
+
+    def create_shadow_indexes(self):
+        self.db.create_shadow_indexes()
+
+    def swap_shadow_table(self):
+        self.db.swap_shadow_table()
+
+    def make_orcid_corrections(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        self.db.make_orcid_corrections(table_name=table_name)
+
+    def apply_overrides(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        self.db.apply_overrides(table_name=table_name)
+
+    def propagate_orcids(self, rows):
+        self.db.propagate_orcids(rows)
+
+    def clear_propagated_orcids(self):
+        self.db.clear_propagated_orcids()
+
+
+# ------------------------------------------------------------------------------------------------
+# SQLite
+# ------------------------------------------------------------------------------------------------
+
+SQLITE_RP_TYPES = ('creator', 'contact', 'associatedParty', 'metadataProvider', 'personnel')
+
+
+def sqlite_responsible_parties_ddl(table_name):
+    # serial_id is the rowid, so, as with a PostgreSQL serial, rows are numbered from 1 in the order inserted
+    return f"""
+        create table {table_name} (
+            serial_id integer primary key,
+            pid text not null,
+            rp_type text not null check (rp_type in {SQLITE_RP_TYPES}),
+            givenname text,
+            surname text,
+            organization text,
+            position text,
+            address text,
+            city text,
+            country text,
+            email text,
+            url text,
+            orcid text,
+            scope text not null,
+            identifier integer not null,
+            correction_codes text,
+            organization_keywords text,
+            skip boolean
+        )
+        """
+
+
+# The table names are unqualified, since SQLite puts an index in the schema of its table
+SQLITE_RESPONSIBLE_PARTIES_INDEXES = [
+    "create index if not exists eml_files.responsible_parties_pid_idx on responsible_parties (pid)",
+    "create index if not exists eml_files.responsible_parties_scope_rp_type_idx "
+    "on responsible_parties (scope, rp_type)",
+    "create index if not exists eml_files.responsible_parties_name_idx on responsible_parties (surname, givenname)",
+    "create index if not exists eml_files.responsible_parties_orcid_idx on responsible_parties (orcid) "
+    "where orcid <> ''"
+]
+
+SQLITE_SCHEMA = [
+    f"""
+    create table if not exists {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} (
+        pid text not null,
+        rp_type text not null check (rp_type in {SQLITE_RP_TYPES}),
+        givenname text,
+        surname text,
+        organization text,
+        position text,
+        address text,
+        city text,
+        country text,
+        email text,
+        url text,
+        orcid text,
+        scope text not null,
+        identifier integer not null
+    )
+    """,
+    "create unique index if not exists eml_files.responsible_parties_raw_key_idx "
+    "on responsible_parties_raw (pid, rp_type, surname, givenname)",
+    sqlite_responsible_parties_ddl(Config.RESPONSIBLE_PARTIES_TABLE_NAME).replace(
+        'create table', 'create table if not exists', 1),
+    *SQLITE_RESPONSIBLE_PARTIES_INDEXES,
+    sqlite_responsible_parties_ddl(Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME).replace(
+        'create table', 'create table if not exists', 1),
+    "create table if not exists eml_files.cleaning_state (fingerprint text)",
+    "insert into eml_files.cleaning_state (fingerprint) values (null)"
+]
+
+# Each is applied once, in order, as with the PostgreSQL migrations, with the database's user_version recording the
+#  last one applied
+SQLITE_MIGRATIONS = [
+    (1, SQLITE_SCHEMA),
+    (2, ["create table if not exists eml_files.propagated_orcids (serial_id integer primary key)"])
+]
+
+
+def sqlite_query(query):
+    # The queries passed to stream_rows use psycopg2's placeholders
+    return query.replace('%s', '?')
+
+
+def sqlite_pids(pids):
+    # A list of PIDs as a single parameter, for use with "pid in (select value from json_each(?))"
+    return json.dumps(list(pids))
+
+
+class SQLiteStorage(Storage):
+    name = 'sqlite'
+
+    @contextmanager
+    def get_conn(self, autocommit=True):
+        # A connection is cheap to open, so each caller gets its own. In WAL mode, a reader sees a consistent
+        #  snapshot while another connection writes. With autocommit=False, the work done on the connection is
+        #  committed as a single transaction on exit, or rolled back on an exception.
+        conn = sqlite3.connect(':memory:', timeout=Config.SQLITE_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("attach database ? as eml_files", (Config.SQLITE_DB_PATH,))
+            conn.execute("pragma eml_files.journal_mode=wal")
+            # As in PostgreSQL, LIKE is case-sensitive
+            conn.execute("pragma case_sensitive_like=on")
+            if not autocommit:
+                conn.execute("begin immediate")
+            yield conn
+            if not autocommit:
+                conn.execute("commit")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("rollback")
+            raise
+        finally:
+            conn.close()
+
+    def migrate(self):
+        with self.get_conn(autocommit=False) as conn:
+            version = conn.execute("pragma eml_files.user_version").fetchone()[0]
+            for migration_version, statements in SQLITE_MIGRATIONS:
+                if version < migration_version:
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"pragma eml_files.user_version={migration_version}")
+
+    def stream_rows(self, query, params=None):
+        # SQLite steps through the results as they're fetched, so they're never all held in memory
+        with self.get_conn() as conn:
+            for row in conn.execute(sqlite_query(query), params or ()):
+                yield row
+
+    def fetch_rows(self, query, params=None):
+        with self.get_conn() as conn:
+            return conn.execute(sqlite_query(query), params or ()).fetchall()
+
+    def analyze(self, table_name):
+        with self.get_conn() as conn:
+            conn.execute(f"analyze {table_name}")
+
+    def count_rows(self, table_name):
+        with self.get_conn() as conn:
+            return conn.execute(f"select count(*) from {table_name}").fetchone()[0]
+
+    def get_cleaning_fingerprint(self):
+        with self.get_conn() as conn:
+            return conn.execute("select fingerprint from eml_files.cleaning_state").fetchone()[0]
+
+    def set_cleaning_fingerprint(self, fingerprint):
+        with self.get_conn() as conn:
+            conn.execute("update eml_files.cleaning_state set fingerprint=?", (fingerprint,))
+
+    def get_all_pids(self):
+        with self.get_conn() as conn:
+            query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} order by pid"
+            return [result[0] for result in conn.execute(query)]
+
+    def get_pids_by_name(self, givenname, surname):
+        with self.get_conn() as conn:
+            query = f"select distinct pid from {Config.RESPONSIBLE_PARTIES_TABLE_NAME} " \
+                    f"where givenname=? and surname=? order by pid"
+            return [result[0] for result in conn.execute(query, (givenname, surname))]
+
+    def load_raw_rows(self, rows, pids_to_delete=None):
+        placeholders = ', '.join('?' for _ in responsible_party_rows.RESPONSIBLE_PARTIES_RAW_COLUMNS)
+        with self.get_conn(autocommit=False) as conn:
+            if pids_to_delete:
+                query = f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} " \
+                        f"where pid in (select value from json_each(?))"
+                conn.execute(query, (sqlite_pids(pids_to_delete),))
+            query = f"insert into {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME} " \
+                    f"({', '.join(responsible_party_rows.RESPONSIBLE_PARTIES_RAW_COLUMNS)}) values ({placeholders})"
+            conn.executemany(query, rows)
+
+    def clear_raw_rows(self):
+        with self.get_conn() as conn:
+            conn.execute(f"delete from {Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME}")
+
+    def delete_pids(self, pids):
+        with self.get_conn(autocommit=False) as conn:
+            for table_name in (Config.RESPONSIBLE_PARTIES_TABLE_NAME, Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME):
+                query = f"delete from {table_name} where pid in (select value from json_each(?))"
+                conn.execute(query, (sqlite_pids(pids),))
+
+    def init_responsible_parties_table(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                       raw_table_name=Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME, pids=None):
+        pid_condition = ''
+        params = ()
+        if pids is not None:
+            pid_condition = ' where pid in (select value from json_each(?))'
+            params = (sqlite_pids(pids),)
+        raw_columns = responsible_party_rows.RESPONSIBLE_PARTIES_RAW_COLUMNS
+        query = f"select {', '.join(raw_columns)} from {raw_table_name}{pid_condition}"
+        raw_rows = self.stream_rows(query, params)
+        columns = raw_columns + ('organization_keywords', 'skip')
+        with self.get_conn(autocommit=False) as conn:
+            # Emptying the table restarts the serial_ids at 1
+            conn.execute(f"delete from {table_name}")
+            query = f"insert into {table_name} ({', '.join(columns)}) values ({', '.join('?' for _ in columns)})"
+            conn.executemany(query, cleaning.clean_records(raw_rows))
+
+    def replace_responsible_parties(self, pids, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                                    staging_table_name=Config.RESPONSIBLE_PARTIES_STAGING_TABLE_NAME):
+        # The staging table numbers its rows from 1, so the rows get new serial_ids, in the same order, in the
+        #  responsible parties table
+        columns = ', '.join(responsible_party_rows.RESPONSIBLE_PARTIES_COLUMNS[1:])
+        with self.get_conn(autocommit=False) as conn:
+            query = f"delete from {table_name} where pid in (select value from json_each(?))"
+            conn.execute(query, (sqlite_pids(pids),))
+            query = f"insert into {table_name} ({columns}) " \
+                    f"select {columns} from {staging_table_name} order by serial_id"
+            conn.execute(query)
+            conn.execute(f"delete from {staging_table_name}")
+
+    def create_shadow_table(self, shadow_table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME):
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute(f"drop table if exists {shadow_table_name}")
+            conn.execute(sqlite_responsible_parties_ddl(shadow_table_name))
+
+    def create_shadow_indexes(self):
+        # SQLite can't rename an index, so the indexes are created by the swap, once the shadow table has the live
+        #  table's name
+        pass
+
+    def swap_shadow_table(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME,
+                          shadow_table_name=Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME):
+        # In WAL mode, readers go on seeing the old table until the swap is committed
+        _, name = table_name.split('.')
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute(f"drop table {table_name}")
+            # The rebuilt table has had no ORCIDs propagated, and its serial_ids start over
+            conn.execute("delete from eml_files.propagated_orcids")
+            conn.execute(f"alter table {shadow_table_name} rename to {name}")
+            for statement in SQLITE_RESPONSIBLE_PARTIES_INDEXES:
+                conn.execute(statement)
+
+    def make_orcid_corrections(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        # As in db.make_orcid_corrections, the last matching correction wins, with a window function in place of
+        #  PostgreSQL's array_agg. LIKE's escape character is made explicit, as PostgreSQL's default is backslash.
+        orcids = corrections.init_orcid_corrections()
+        rows = [(seq, orcid_obj.type, orcid_obj.surname, orcid_obj.givenname, orcid_obj.orcid)
+                for seq, orcid_obj in enumerate(orcids)]
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute("create temp table orcid_corrections "
+                         "(seq int, type text, surname text, givenname text, orcid text)")
+            conn.executemany("insert into orcid_corrections values (?, ?, ?, ?, ?)", rows)
+            query = f"update {table_name} as t set orcid=m.orcid, correction_codes=m.correction_codes from (" \
+                    f"select serial_id, last_orcid as orcid, " \
+                    f"case when max(is_stipulation) then '99' else '0' end as correction_codes, " \
+                    f"max(is_stipulation or differs) as changed from (" \
+                    f"select r.serial_id, c.type='stipulation' as is_stipulation, c.orcid <> r.orcid as differs, " \
+                    f"first_value(c.orcid) over (partition by r.serial_id order by c.seq desc) as last_orcid " \
+                    f"from {table_name} r join orcid_corrections c " \
+                    f"on r.surname=c.surname and r.givenname like c.givenname escape '\\' " \
+                    f"where r.orcid <> '') group by serial_id, last_orcid) as m " \
+                    f"where t.serial_id=m.serial_id and m.changed"
+            conn.execute(query)
+
+    def apply_overrides(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        # The rounds of db.apply_overrides, with each round's overrides chosen into a temp table, since SQLite's
+        #  common table expressions can't contain an update
+        override_corrections = corrections.init_override_corrections()
+        rows = [(seq, override.original_surname, '%' in override.original_surname, override.original_givenname,
+                 override.scope, override.surname, override.givenname)
+                for seq, override in enumerate(override_corrections, 1)]
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute("create temp table overrides (seq int, original_surname text, is_pattern boolean, "
+                         "original_givenname text, scope text, surname text, givenname text)")
+            conn.executemany("insert into overrides values (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("create temp table applied_overrides (serial_id integer primary key, seq int)")
+            conn.execute("create temp table next_overrides (serial_id integer primary key, seq int, "
+                         "surname text, givenname text)")
+            select_query = f"insert into next_overrides (serial_id, seq, surname, givenname) " \
+                           f"select serial_id, seq, surname, givenname from (" \
+                           f"select t.serial_id, o.seq, o.surname, o.givenname, " \
+                           f"row_number() over (partition by t.serial_id order by o.seq) as n " \
+                           f"from {table_name} t join overrides o " \
+                           f"on t.givenname=o.original_givenname and t.scope=o.scope " \
+                           f"and (t.surname=o.original_surname or " \
+                           f"(o.is_pattern and t.surname like o.original_surname escape '\\')) " \
+                           f"left join applied_overrides a on a.serial_id=t.serial_id " \
+                           f"where o.seq > coalesce(a.seq, 0)) where n=1"
+            update_query = f"update {table_name} as t set surname=n.surname, givenname=n.givenname " \
+                           f"from next_overrides n where t.serial_id=n.serial_id"
+            applied_query = "insert into applied_overrides (serial_id, seq) " \
+                            "select serial_id, seq from next_overrides where true " \
+                            "on conflict (serial_id) do update set seq=excluded.seq"
+            while True:
+                conn.execute("delete from next_overrides")
+                if conn.execute(select_query).rowcount == 0:
+                    break
+                conn.execute(update_query)
+                conn.execute(applied_query)
+
+    def propagate_orcids(self, rows, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        # As in db.propagate_orcids, with the rows filled in recorded before they're updated, since SQLite's
+        #  common table expressions can't contain an update
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute("create temp table orcids (serial_id integer primary key, orcid text, correction_codes text)")
+            conn.executemany("insert into orcids values (?, ?, ?)", rows)
+            conn.execute(f"insert or ignore into eml_files.propagated_orcids (serial_id) "
+                         f"select t.serial_id from {table_name} t join orcids o on t.serial_id=o.serial_id "
+                         f"where t.orcid=''")
+            conn.execute(f"update {table_name} as t set orcid=o.orcid, correction_codes=o.correction_codes "
+                         f"from orcids o where t.serial_id=o.serial_id and t.orcid=''")
+
+    def clear_propagated_orcids(self, table_name=Config.RESPONSIBLE_PARTIES_TABLE_NAME):
+        with self.get_conn(autocommit=False) as conn:
+            conn.execute(f"update {table_name} as t set orcid='', correction_codes=null "
+                         f"from eml_files.propagated_orcids p where t.serial_id=p.serial_id")
+            conn.execute("delete from eml_files.propagated_orcids")
+
+
+# ------------------------------------------------------------------------------------------------
+
+STORAGE_BACKENDS = {
+    PostgresStorage.name: PostgresStorage,
+    SQLiteStorage.name: SQLiteStorage
+}
+
+storage = None
+
+
+def get_storage():
+    global storage
+
+    if storage is None or storage.name != Config.STORAGE_BACKEND:
+        if Config.STORAGE_BACKEND not in STORAGE_BACKENDS:
+            raise ValueError(f'Unknown storage backend: {Config.STORAGE_BACKEND}')
+        storage = STORAGE_BACKENDS[Config.STORAGE_BACKEND]()
+    return storage
+
+
+def time_rebuild(backend):
+    # Time the stages of a full rebuild from the responsible parties record store with the given backend
+    Config.STORAGE_BACKEND = backend
+    store = get_storage()
+    timings = []
+
+    def timed(stage, f, *args):
+        start = time.perf_counter()
+        f(*args)
+        timings.append((stage, time.perf_counter() - start))
+
+    timed('migrate', store.migrate)
+    timed('clear raw', store.clear_raw_rows)
+    timed('build raw', store.build_responsible_party_raw_db, Config.RESPONSIBLE_PARTIES_RECORDS_FILE)
+    timed('analyze raw', store.analyze, Config.RESPONSIBLE_PARTIES_RAW_TABLE_NAME)
+    timed('create shadow', store.create_shadow_table)
+    timed('clean', store.init_responsible_parties_table, Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+    timed('shadow indexes', store.create_shadow_indexes)
+    timed('orcid corrections', store.make_orcid_corrections, Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+    timed('overrides', store.apply_overrides, Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+    timed('analyze', store.analyze, Config.RESPONSIBLE_PARTIES_SHADOW_TABLE_NAME)
+    timed('swap', store.swap_shadow_table)
+    store.set_cleaning_fingerprint(corrections.get_cleaning_fingerprint())
+    return timings, store.count_rows(Config.RESPONSIBLE_PARTIES_TABLE_NAME)
+
+
+if __name__ == '__main__':
+    timings, count = time_rebuild(sys.argv[1] if len(sys.argv) > 1 else Config.STORAGE_BACKEND)
+    for stage, seconds in timings:
+        print(f'{stage:20} {seconds:8.2f}s')
+    print(f'{"total":20} {sum(seconds for _, seconds in timings):8.2f}s  {count} rows')
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+:Mod: text_store
+
+:Synopsis:
+    The store of the text harvested from the EML files by parse_eml.harvest_eml_text, kept in a SQLite database in
+    Config.EML_TEXT_DB_PATH. There's a row per PID, with a column per text component, each holding the component's
+    value as JSON, so a PID's text can be written, read, or deleted on its own, and a reader loads just the
+    components it asks for.
+
+:Author:
+    ide
+
+:Created:
+    10/19/26
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+
+from webapp.config import Config
+
+
+COMPONENTS = ('dataset_title', 'dataset_abstract', 'dataset_keywords', 'datatable_descriptions',
+              'dataset_geographic_descriptions', 'method_step_descriptions', 'projects', 'related_projects')
+
+
+@contextmanager
+def get_conn():
+    conn = sqlite3.connect(Config.EML_TEXT_DB_PATH, timeout=Config.SQLITE_TIMEOUT)
+    try:
+        conn.execute("pragma journal_mode=wal")
+        columns = ', '.join(f'{component} text' for component in COMPONENTS)
+        conn.execute(f"create table if not exists eml_text (pid text primary key, {columns})")
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_pids(conn):
+    return {pid for pid, in conn.execute("select pid from eml_text")}
+
+
+def put(conn, pid, components):
+    # components is {component: value}, with a value for each of COMPONENTS
+    placeholders = ', '.join('?' for _ in COMPONENTS)
+    query = f"insert or replace into eml_text (pid, {', '.join(COMPONENTS)}) values (?, {placeholders})"
+    conn.execute(query, (pid, *(json.dumps(components[component]) for component in COMPONENTS)))
+
+
+def get(conn, pid, components=COMPONENTS):
+    # Returns {component: value} for just the given components, or None if the PID's text hasn't been harvested
+    query = f"select {', '.join(components)} from eml_text where pid=?"
+    row = conn.execute(query, (pid,)).fetchone()
+    if row is None:
+        return None
+    return {component: json.loads(value) for component, value in zip(components, row)}
+
+
+def delete_pids(pids):
+    # Nothing to do if no text has been harvested
+    if not pids or not os.path.exists(Config.EML_TEXT_DB_PATH):
+        return
+    with get_conn() as conn:
+        conn.executemany("delete from eml_text where pid=?", ((pid,) for pid in pids))